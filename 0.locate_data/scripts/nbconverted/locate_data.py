@@ -13,7 +13,7 @@ import numpy as np
 
 import sys
 sys.path.append("../utils/")
-from locate_utils import get_uncompiled_training_locations, get_final_training_locations, get_control_locations
+from locate_utils import get_uncompiled_training_locations, get_final_training_locations, get_controls_locations
 
 
 # ### Specify paths
@@ -49,7 +49,9 @@ training_data_locations
 
 negative_control_save_path = pathlib.Path(f"{locations_dir}/negative_control_locations.tsv")
 
-negative_control_locations = get_control_locations(annotations_path, "negative", 0)
+# get negative and positive control locations with one annotations scan
+controls_locations = get_controls_locations(annotations_path, {"negative": 0, "positive": 1})
+negative_control_locations = controls_locations["negative"]
 negative_control_locations.to_csv(negative_control_save_path, sep="\t")
 
 negative_control_locations
@@ -62,7 +64,7 @@ negative_control_locations
 
 positive_control_save_path = pathlib.Path(f"{locations_dir}/positive_control_locations.tsv")
 
-positive_control_locations = get_control_locations(annotations_path, "positive", 1)
+positive_control_locations = controls_locations["positive"]
 positive_control_locations.to_csv(positive_control_save_path, sep="\t")
 
 positive_control_locations
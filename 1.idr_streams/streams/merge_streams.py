@@ -7,6 +7,9 @@ import pandas as pd
 sys.path.append("../IDR_stream/")
 from idrstream.merge_CP_DP import save_merged_CP_DP_run
 
+sys.path.append("../../utils/")
+from load_utils import convert_mitocheck_batch_data_to_parquet
+
 # path to directory with IDR_stream run outputs (training_data, negative_control_data, positive_control_data)
 extracted_features = pathlib.Path("../extracted_features/")
 
@@ -26,3 +29,6 @@ for data_type, dataset_type in itertools.product(data_types, dataset_types):
 
     # merge CP and DP runs!
     save_merged_CP_DP_run(cp_data_dir_path, dp_data_dir_path, merged_data_dir_path)
+
+    # convert merged batches to a parquet feature store (merged_features_parquet) for downstream loading
+    convert_mitocheck_batch_data_to_parquet(merged_data_dir_path)
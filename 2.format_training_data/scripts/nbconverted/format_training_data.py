@@ -6,14 +6,17 @@
 # In[1]:
 
 
+import os
 import pathlib
 import pandas as pd
 import numpy as np
+import pyarrow.parquet as pq
 
 import sys
 sys.path.append("../utils")
 from load_utils import compile_mitocheck_batch_data
 from training_data_utils import get_labeled_cells
+from outline_utils import get_compact_outlines_table
 
 
 # ## Set save directory
@@ -30,28 +33,36 @@ results_dir.mkdir(exist_ok=True, parents=True)
 # In[3]:
 
 
-dataset_types = ["ic", "no_ic"]
+# labeled samples are matched on a process pool, so work is only done in the main process
+# (worker processes started with spawn import this script without running it)
+if __name__ == "__main__":
+    dataset_types = ["ic", "no_ic"]
 
-for dataset_type in dataset_types:
-    print(f"Compiling data for dataset type {dataset_type}")
+    for dataset_type in dataset_types:
+        print(f"Compiling data for dataset type {dataset_type}")
 
-    # Load training data
-    training_data_features_path = pathlib.Path(f"../1.idr_streams/extracted_features/training_data__{dataset_type}/merged_features/")
-    training_data = compile_mitocheck_batch_data(training_data_features_path)
-    print(f"Training data has {training_data.shape}")
+        # Load training data
+        training_data_features_path = pathlib.Path(f"../1.idr_streams/extracted_features/training_data__{dataset_type}/merged_features/")
+        training_data = compile_mitocheck_batch_data(training_data_features_path, use_parquet_store=True)
+        print(f"Training data has {training_data.shape}")
     
-    # Find cells with MitoCheck data
-    # Cells may not have feature data found because the specific well is not hosted on IDr (failure to pass QC) or because of differences in Mitocheck/DeepProfiler segmentation
-    features_samples_path = pathlib.Path("../mitocheck_metadata/features.samples.txt")
-    training_cells = get_labeled_cells(training_data, features_samples_path, "DP__Object_Outline")
-    print(f"Shape of labeled_cells: {training_cells.shape}")
+        # Find cells with MitoCheck data
+        # Cells may not have feature data found because the specific well is not hosted on IDr (failure to pass QC) or because of differences in Mitocheck/DeepProfiler segmentation
+        features_samples_path = pathlib.Path("../mitocheck_metadata/features.samples.txt")
+        # Labeled samples are matched to cell outlines in parallel (sharded by frame)
+        training_cells = get_labeled_cells(training_data, features_samples_path, "DP__Object_Outline", n_workers=os.cpu_count())
+        print(f"Shape of labeled_cells: {training_cells.shape}")
     
-    # Replace `Shape1` and `Shape3` with their respective classes
-    # See https://github.com/WayScience/mitocheck_data/issues/16 for more details
-    training_cells = training_cells.replace("Shape1", "Binuclear")
-    training_cells = training_cells.replace("Shape3", "Polylobed")
+        # Replace `Shape1` and `Shape3` with their respective classes
+        # See https://github.com/WayScience/mitocheck_data/issues/16 for more details
+        training_cells = training_cells.replace("Shape1", "Binuclear")
+        training_cells = training_cells.replace("Shape3", "Polylobed")
     
-    # Save compiled training data
-    compiled_training_data_path = pathlib.Path(f"{results_dir}/training_data__{dataset_type}.csv.gz")
-    training_cells.to_csv(compiled_training_data_path, compression="gzip")
+        # Save compiled training data
+        compiled_training_data_path = pathlib.Path(f"{results_dir}/training_data__{dataset_type}.csv.gz")
+        training_cells.to_csv(compiled_training_data_path, compression="gzip")
+    
+        # Save compiled training data with compact (int16 coordinate list) outlines
+        compact_training_data_path = pathlib.Path(f"{results_dir}/training_data__{dataset_type}.parquet")
+        pq.write_table(get_compact_outlines_table(training_cells), compact_training_data_path)
 
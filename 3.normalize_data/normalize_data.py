@@ -1,4 +1,5 @@
 import pathlib
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 from sklearn.preprocessing import StandardScaler
@@ -7,58 +8,73 @@ from joblib import dump
 import sys
 
 sys.path.append("../utils")
-from load_utils import compile_mitocheck_batch_data
-from normalization_utils import get_normalization_scaler, get_normalized_mitocheck_data
+from normalization_utils import get_cached_normalization_scaler, write_normalized_mitocheck_data
+from feature_store_utils import save_feature_store
 
 extracted_features_path = pathlib.Path(f"../1.idr_streams/extracted_features/")
 dataset_types = ["ic", "no_ic"]
 
-# iterate through dataset types (with/without illumination correction)
-for dataset_type in dataset_types:
-    
-    # get normalization scaler from negative control features (normalization population)
-    print("Getting normalization scaler...")
-    negative_control_data_path = pathlib.Path(f"{extracted_features_path}/negative_control_data__{dataset_type}/merged_features")
-    normalization_scaler = get_normalization_scaler(negative_control_data_path)
+# make results dir if it does not already exist
+results_dir = pathlib.Path("normalized_data/")
 
-    # save normalization scaler
-    norm_scaler_save_path = pathlib.Path(f"scaler/normalization_scaler__{dataset_type}.joblib")
-    norm_scaler_save_path.parent.mkdir(parents=True, exist_ok=True)
-    dump(normalization_scaler, norm_scaler_save_path)
+# fitted normalization scalers are cached here by fingerprint of their normalization population
+scaler_cache_dir = pathlib.Path("scaler/.cache/")
 
-    # make results dir if it does not already exist
-    results_dir = pathlib.Path("normalized_data/")
+# maximum number of rows each normalization task holds in memory at a time
+chunk_rows = 100000
+
+if __name__ == "__main__":
     results_dir.mkdir(parents=True, exist_ok=True)
 
-    # normalize the data at the following paths
-    training_data_path = pathlib.Path(f"{extracted_features_path}/training_data__{dataset_type}/merged_features")
-    negative_control_data_path = pathlib.Path(f"{extracted_features_path}/negative_control_data__{dataset_type}/merged_features")
-    positive_control_data_path = pathlib.Path(f"{extracted_features_path}/positive_control_data__{dataset_type}/merged_features")
+    # (data path, normalization scaler, save path) for each normalization task
+    normalization_tasks = []
+
+    # iterate through dataset types (with/without illumination correction)
+    for dataset_type in dataset_types:
+
+        # get normalization scaler from negative control features (normalization population)
+        # the scaler is fit incrementally over streamed batches so the full population is never in memory
+        # a cached scaler is loaded instead if the negative control batches and feature columns have not changed
+        print(f"Getting normalization scaler for dataset type {dataset_type}...")
+        negative_control_data_path = pathlib.Path(f"{extracted_features_path}/negative_control_data__{dataset_type}/merged_features")
+        normalization_scaler, cache_hit = get_cached_normalization_scaler(
+            negative_control_data_path,
+            scaler_cache_dir,
+            f"normalization_scaler__{dataset_type}",
+            streaming=True,
+        )
+
+        # save normalization scaler if it was refit
+        norm_scaler_save_path = pathlib.Path(f"scaler/normalization_scaler__{dataset_type}.joblib")
+        if not cache_hit or not norm_scaler_save_path.exists():
+            norm_scaler_save_path.parent.mkdir(parents=True, exist_ok=True)
+            dump(normalization_scaler, norm_scaler_save_path)
+
+        # normalize the data at the following paths
+        training_data_path = pathlib.Path(f"../2.format_training_data/results/training_data__{dataset_type}.csv.gz")
+        positive_control_data_path = pathlib.Path(f"{extracted_features_path}/positive_control_data__{dataset_type}/merged_features")
 
-    # normalize training data
-    print("Normalizing training data...")
-    data = pd.read_csv(training_data_path, compression="gzip", index_col=0)
-    normalized_data = get_normalized_mitocheck_data(data, normalization_scaler)
-    # save normalized training data
-    save_path = pathlib.Path(f"{results_dir}/{training_data_path.name}")
-    normalized_data.to_csv(save_path, compression="gzip")
+        normalization_tasks += [
+            (training_data_path, normalization_scaler, pathlib.Path(f"{results_dir}/training_data__{dataset_type}.csv.gz")),
+            (negative_control_data_path, normalization_scaler, pathlib.Path(f"{results_dir}/negative_control_data__{dataset_type}.csv.gz")),
+            (positive_control_data_path, normalization_scaler, pathlib.Path(f"{results_dir}/positive_control_data__{dataset_type}.csv.gz")),
+        ]
 
-    # normalize negative control data
-    print("Loading negative control data...")
-    data = compile_mitocheck_batch_data(negative_control_data_path)
-    print("Normalizing negative control data...")
-    normalized_data = get_normalized_mitocheck_data(data, normalization_scaler)
-    # save normalized negative control data
-    save_path = pathlib.Path(f"{results_dir}/{negative_control_data_path.name}")
-    print("Saving normalized negative control data...")
-    normalized_data.to_csv(save_path, compression="gzip", index=False)
+    # normalize training, negative control, and positive control data as independent parallel tasks
+    # each task streams its data in chunks and appends each normalized chunk to its save path
+    print("Normalizing data...")
+    with ProcessPoolExecutor(max_workers=len(normalization_tasks)) as executor:
+        save_paths = executor.map(
+            write_normalized_mitocheck_data,
+            *zip(*normalization_tasks),
+            ["CP_and_DP"] * len(normalization_tasks),
+            [chunk_rows] * len(normalization_tasks),
+        )
+        for save_path in save_paths:
+            print(f"Saved normalized data to {save_path}")
 
-    # normalize positive control data
-    print("Loading positive control data...")
-    data = compile_mitocheck_batch_data(positive_control_data_path)
-    print("Normalizing positive control data...")
-    normalized_data = get_normalized_mitocheck_data(data, normalization_scaler)
-    # save normalized positive control data
-    save_path = pathlib.Path(f"{results_dir}/{positive_control_data_path.name}")
-    print("Saving normalized positive control data...")
-    normalized_data.to_csv(save_path, compression="gzip", index=False)
+    # save normalized training data as a memory-mappable feature store for analysis
+    for dataset_type in dataset_types:
+        normalized_data = pd.read_csv(f"{results_dir}/training_data__{dataset_type}.csv.gz", compression="gzip", index_col=0)
+        store_path = pathlib.Path(f"{results_dir}/training_data__{dataset_type}_store")
+        save_feature_store(normalized_data, store_path)
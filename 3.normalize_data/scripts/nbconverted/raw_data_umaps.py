@@ -8,14 +8,16 @@
 
 import pathlib
 import sys
+import tempfile
 
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 
 sys.path.append("../utils")
-from load_utils import compile_mitocheck_batch_data, split_data
-from analysis_utils import get_2D_umap_embeddings, show_2D_umap_from_embeddings
+from load_utils import compile_mitocheck_batch_data
+from feature_store_utils import load_feature_store, save_feature_store
+from analysis_utils import schedule_umap_embeddings, show_2D_umap_from_embeddings
 
 
 # ### Compile control data
@@ -31,41 +33,51 @@ dataset_types = ["ic", "no_ic"]
 feature_types = ["CP", "DP", "CP_and_DP"]
 metadata_fields = ["Metadata_Plate", "Metadata_Well", "Metadata_Frame", "Metadata_Gene"]
 
+# umap embeddings are cached here so re-rendering umaps does not refit them
+umap_cache_dir = pathlib.Path("umap_cache/")
+
 
 # ### Get control data, get umap embeddings, create umap
 
 # In[3]:
 
 
-for dataset_type in dataset_types:
-    
-    # compile a fraction of control data
-    print(f"Compiling control data for dataset type {dataset_type}...")
-    
-    # get 10% of negative control features
-    negative_control_data_path = pathlib.Path(f"{extracted_features_path}/negative_control_data__{dataset_type}/merged_features")
-    negative_control_data = compile_mitocheck_batch_data(negative_control_data_path)
-    negative_control_data = negative_control_data.sample(frac=0.1, random_state=0)
-
-    # get 10% of positive control features
-    positive_control_data_path = pathlib.Path(f"{extracted_features_path}/positive_control_data__{dataset_type}/merged_features")
-    positive_control_data = compile_mitocheck_batch_data(positive_control_data_path)
-    positive_control_data = positive_control_data.sample(frac=0.1, random_state=0)
-
-    # combine negative and positive control features
-    control_data = pd.concat([negative_control_data, positive_control_data])
-    # shuffle data so negative/positive controls are not ordered
-    control_data = control_data.sample(frac=1, random_state=0)
-    
-    # get 2D umap embeddings
-    for feature_type in feature_types:
-        print(f"Getting 2D umap embeddings for feature type {feature_type}...")
-        metadata_dataframe, feature_data = split_data(control_data, feature_type)
-        x_data, y_data = get_2D_umap_embeddings(feature_data)
-        
-        # create 2D umaps colored by metadata
-        for metadata_field in metadata_fields:
-            print(f"Creating 2D umap for metadata field {metadata_field}...")
-            metadata = metadata_dataframe[metadata_field]
-            show_2D_umap_from_embeddings(x_data, y_data, metadata)
+# umap embedding jobs run on a process pool, so work is only done in the main process
+# (worker processes started with spawn import this script without running it)
+if __name__ == "__main__":
+    for dataset_type in dataset_types:
+
+        # compile a fraction of control data
+        print(f"Compiling control data for dataset type {dataset_type}...")
+
+        # get 10% of negative control features (sampled while loading)
+        negative_control_data_path = pathlib.Path(f"{extracted_features_path}/negative_control_data__{dataset_type}/merged_features")
+        negative_control_data = compile_mitocheck_batch_data(negative_control_data_path, use_parquet_store=True, sample_frac=0.1, sample_seed=0)
+
+        # get 10% of positive control features (sampled while loading)
+        positive_control_data_path = pathlib.Path(f"{extracted_features_path}/positive_control_data__{dataset_type}/merged_features")
+        positive_control_data = compile_mitocheck_batch_data(positive_control_data_path, use_parquet_store=True, sample_frac=0.1, sample_seed=0)
+
+        # combine negative and positive control features
+        control_data = pd.concat([negative_control_data, positive_control_data])
+        # shuffle data so negative/positive controls are not ordered
+        control_data = control_data.sample(frac=1, random_state=0)
+
+        # save control data to a temporary feature store so umap jobs memory-map it instead of copying it
+        with tempfile.TemporaryDirectory() as temp_dir:
+            control_data_store_path = save_feature_store(control_data, pathlib.Path(f"{temp_dir}/control_data__{dataset_type}_store"))
+            metadata_dataframe, _, _ = load_feature_store(control_data_store_path)
+
+            # get 2D umap embeddings for each feature type as parallel jobs
+            print(f"Getting 2D umap embeddings for feature types {feature_types}...")
+            umap_embedding_jobs = [(feature_type, control_data_store_path, feature_type) for feature_type in feature_types]
+            umap_embeddings = schedule_umap_embeddings(umap_embedding_jobs, n_components=2, cache_dir=umap_cache_dir)
+
+        for feature_type in feature_types:
+            x_data, y_data = umap_embeddings[feature_type].T
 
+            # create 2D umaps colored by metadata
+            for metadata_field in metadata_fields:
+                print(f"Creating 2D umap for metadata field {metadata_field}...")
+                metadata = metadata_dataframe[metadata_field]
+                show_2D_umap_from_embeddings(x_data, y_data, metadata)
@@ -15,8 +15,8 @@ from matplotlib.colors import rgb2hex
 import sys
 
 sys.path.append("../utils")
-from load_utils import split_data
-from analysis_utils import get_class_colors, show_1D_umap, show_2D_umap
+from feature_store_utils import load_feature_store
+from analysis_utils import get_class_colors, schedule_umap_embeddings, show_2D_umap
 
 
 # ### Set training data load path, dataset types, save directory
@@ -39,6 +39,9 @@ feature_types = ["CP", "DP", "CP_and_DP"]
 results_dir = pathlib.Path("results/")
 results_dir.mkdir(parents=True, exist_ok=True)
 
+# umap embeddings are cached here so re-rendering umaps does not refit them
+umap_cache_dir = pathlib.Path("umap_cache/")
+
 
 # ### Set UMAP display settings and class colors
 # 
@@ -103,64 +106,82 @@ compiled_single_cell_class_counts = []
 # list to compile embeddings tidy data
 compiled_tidy_embeddings = []
 
-for dataset_type in dataset_types:
-    
-    # load training data
-    training_data_path = pathlib.Path(
-        f"{training_data_dir}/training_data__{dataset_type}.csv.gz"
-    )
-    training_data = pd.read_csv(training_data_path, compression="gzip", index_col=0)
-    
-    # save single-cell counts per phenotype
-    # get single-cell class counts
-    single_cell_class_counts = (
-        training_data["Mitocheck_Phenotypic_Class"]
-        .value_counts()
-        .rename_axis("Mitocheck_Phenotypic_Class")
-        .reset_index(name="Single_Cell_Counts")
-    )
-    single_cell_class_counts["Dataset_Type"] = dataset_type
-    
-    # add these single cell counts to compilation
-    compiled_single_cell_class_counts.append(single_cell_class_counts)
-    
-    # create umaps for each feature type
-    for feature_type in feature_types:
-        print(f"Showing UMAPs created with {feature_type} features")
-
-        # the trainind data dataframe is split into two components:
-        # metadata: info about the cell including its labeled phenotypic class, location, perturbation, etc
-        # feature data: the CP, DP, or merged features for each cell
-        metadata_dataframe, feature_data = split_data(training_data, feature_type)
-        phenotypic_classes = metadata_dataframe["Mitocheck_Phenotypic_Class"]
-
-        # show 2D umaps
-        # class colors 1 - all classes included
-        embeddings_2D = show_2D_umap(
-            feature_data,
-            phenotypic_classes,
-            class_colors_1,
-            point_size=point_size,
-            alpha=alpha,
+# umap embedding jobs run on a process pool, so work is only done in the main process
+# (worker processes started with spawn import this script without running it)
+if __name__ == "__main__":
+    # get 2D umap embeddings for every dataset type and feature type as parallel jobs
+    # each job memory-maps its feature data from the training data feature store
+    # the umaps shown below are created from these embeddings instead of refitting umap
+    umap_embedding_jobs = [
+        (
+            (dataset_type, feature_type),
+            pathlib.Path(f"{training_data_dir}/training_data__{dataset_type}_store"),
+            feature_type,
         )
+        for dataset_type in dataset_types
+        for feature_type in feature_types
+    ]
+    umap_embeddings = schedule_umap_embeddings(umap_embedding_jobs, n_components=2, cache_dir=umap_cache_dir)
 
-        # add feature types column for tidy long data
-        embeddings_2D["Dataset_Type"] = dataset_type
-        # add feature types column for tidy long data
-        embeddings_2D["Feature_Type"] = feature_type
-        # add cell UUID types column for tidy long data
-        embeddings_2D["Cell_UUID"] = metadata_dataframe["Cell_UUID"]
-        # melt embeddings data into tidy format
-        embeddings_2D = pd.melt(
-            embeddings_2D,
-            id_vars=["Mitocheck_Phenotypic_Class", "Dataset_Type", "Feature_Type", "Cell_UUID"],
-            value_vars=["UMAP1", "UMAP2"],
-            var_name="UMAP_Embedding",
-            value_name="Embedding_Value",
-        )
+    for dataset_type in dataset_types:
 
-        # add these tidy embeddings to compilation
-        compiled_tidy_embeddings.append(embeddings_2D)
+        # load training data
+        # the trainind data feature store is split into two components:
+        # metadata: info about the cell including its labeled phenotypic class, location, perturbation, etc
+        # feature blocks: the CP, DP, and merged features for each cell (memory-mapped views of one feature matrix)
+        training_data_store_path = pathlib.Path(
+            f"{training_data_dir}/training_data__{dataset_type}_store"
+        )
+        metadata_dataframe, feature_blocks, _ = load_feature_store(training_data_store_path)
+
+        # save single-cell counts per phenotype
+        # get single-cell class counts
+        single_cell_class_counts = (
+            metadata_dataframe["Mitocheck_Phenotypic_Class"]
+            .value_counts()
+            .rename_axis("Mitocheck_Phenotypic_Class")
+            .reset_index(name="Single_Cell_Counts")
+        )
+        single_cell_class_counts["Dataset_Type"] = dataset_type
+
+        # add these single cell counts to compilation
+        compiled_single_cell_class_counts.append(single_cell_class_counts)
+
+        # create umaps for each feature type
+        for feature_type in feature_types:
+            print(f"Showing UMAPs created with {feature_type} features")
+
+            feature_data = feature_blocks[feature_type]
+            phenotypic_classes = metadata_dataframe["Mitocheck_Phenotypic_Class"]
+
+            # show 2D umaps
+            # class colors 1 - all classes included
+            embeddings_2D = show_2D_umap(
+                feature_data,
+                phenotypic_classes,
+                class_colors_1,
+                point_size=point_size,
+                alpha=alpha,
+                umap_embeddings=umap_embeddings[(dataset_type, feature_type)],
+            )
+
+            # add feature types column for tidy long data
+            embeddings_2D["Dataset_Type"] = dataset_type
+            # add feature types column for tidy long data
+            embeddings_2D["Feature_Type"] = feature_type
+            # add cell UUID types column for tidy long data
+            embeddings_2D["Cell_UUID"] = metadata_dataframe["Cell_UUID"]
+            # melt embeddings data into tidy format
+            embeddings_2D = pd.melt(
+                embeddings_2D,
+                id_vars=["Mitocheck_Phenotypic_Class", "Dataset_Type", "Feature_Type", "Cell_UUID"],
+                value_vars=["UMAP1", "UMAP2"],
+                var_name="UMAP_Embedding",
+                value_name="Embedding_Value",
+            )
+
+            # add these tidy embeddings to compilation
+            compiled_tidy_embeddings.append(embeddings_2D)
 
 
 # ### Save and preview tidy single-cell class counts
@@ -168,14 +189,15 @@ for dataset_type in dataset_types:
 # In[5]:
 
 
-# compile tidy embeddings into one dataframe
-compiled_single_cell_class_counts = pd.concat(compiled_single_cell_class_counts).reset_index(drop=True)
+if __name__ == "__main__":
+    # compile tidy embeddings into one dataframe
+    compiled_single_cell_class_counts = pd.concat(compiled_single_cell_class_counts).reset_index(drop=True)
 
-# save single-cell class counts
-single_cell_class_counts_save_path = pathlib.Path(
-    f"{results_dir}/single_cell_class_counts.csv"
-)
-compiled_single_cell_class_counts.to_csv(single_cell_class_counts_save_path)
+    # save single-cell class counts
+    single_cell_class_counts_save_path = pathlib.Path(
+        f"{results_dir}/single_cell_class_counts.csv"
+    )
+    compiled_single_cell_class_counts.to_csv(single_cell_class_counts_save_path)
 
 # preview single-cell class counts
 compiled_single_cell_class_counts
@@ -187,14 +209,15 @@ compiled_single_cell_class_counts
 # In[6]:
 
 
-# compile tidy embeddings into one dataframe
-compiled_tidy_embeddings = pd.concat(compiled_tidy_embeddings).reset_index(drop=True)
+if __name__ == "__main__":
+    # compile tidy embeddings into one dataframe
+    compiled_tidy_embeddings = pd.concat(compiled_tidy_embeddings).reset_index(drop=True)
 
-# save tidy embeddings
-compiled_tidy_embeddings_save_path = pathlib.Path(
-    f"{results_dir}/compiled_2D_umap_embeddings.csv"
-)
-compiled_tidy_embeddings.to_csv(compiled_tidy_embeddings_save_path)
+    # save tidy embeddings
+    compiled_tidy_embeddings_save_path = pathlib.Path(
+        f"{results_dir}/compiled_2D_umap_embeddings.csv"
+    )
+    compiled_tidy_embeddings.to_csv(compiled_tidy_embeddings_save_path)
 
 # preview tidy embeddings data
 compiled_tidy_embeddings
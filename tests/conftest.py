@@ -0,0 +1,5 @@
+import pathlib
+import sys
+
+# utils are imported as flat modules, like the notebooks do with sys.path.append("../utils")
+sys.path.append(str(pathlib.Path(__file__).parents[1] / "utils"))
@@ -0,0 +1,23 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+for module_name in ["matplotlib", "seaborn", "pandas", "umap", "numba", "pynndescent", "threadpoolctl"]:
+    pytest.importorskip(module_name)
+
+from analysis_utils import UMAP_EXACT_KNN_SAMPLE_LIMIT, uses_shared_knn_graph
+
+
+@pytest.mark.parametrize(
+    "num_samples, uses_knn_graph",
+    [
+        (UMAP_EXACT_KNN_SAMPLE_LIMIT - 1, False),
+        (UMAP_EXACT_KNN_SAMPLE_LIMIT, True),
+        (UMAP_EXACT_KNN_SAMPLE_LIMIT + 1, True),
+    ],
+)
+def test_uses_shared_knn_graph_at_exact_knn_sample_limit(num_samples, uses_knn_graph):
+    feature_data = np.zeros((num_samples, 2))
+
+    assert UMAP_EXACT_KNN_SAMPLE_LIMIT == 4096
+    assert uses_shared_knn_graph(feature_data, knn_graph={}) == uses_knn_graph
+    assert not uses_shared_knn_graph(feature_data, knn_graph=None)
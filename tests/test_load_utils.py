@@ -0,0 +1,49 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+
+from load_utils import compact_mitocheck_data, concat_compact_batches
+
+
+def get_batch(plates: list, genes: list) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "Metadata_Plate": plates,
+            "Metadata_Well": [1] * len(plates),
+            "Metadata_Frame": [2] * len(plates),
+            "Metadata_Gene": genes,
+            "CP__Area": np.arange(len(plates), dtype=np.float64),
+            "DP__efficientnet_0": np.arange(len(plates), dtype=np.float64),
+        }
+    )
+
+
+def test_concat_compact_batches_with_empty_batch():
+    # empty (or all sampled out) csv batches are loaded with object columns
+    empty_batch = get_batch([], []).astype(object)
+    batches = [
+        compact_mitocheck_data(get_batch(["plate_a", "plate_b"], ["gene_a", "gene_b"])),
+        compact_mitocheck_data(empty_batch),
+    ]
+
+    data = concat_compact_batches(batches)
+
+    assert len(data) == 2
+    assert data["CP__Area"].dtype == np.float32
+    assert data["DP__efficientnet_0"].dtype == np.float32
+    assert isinstance(data["Metadata_Plate"].dtype, pd.CategoricalDtype)
+
+
+def test_concat_compact_batches_with_all_nan_metadata_batch():
+    batches = [
+        compact_mitocheck_data(get_batch(["plate_a"], ["gene_a"])),
+        compact_mitocheck_data(get_batch(["plate_b"], [np.nan])),
+    ]
+
+    data = concat_compact_batches(batches)
+
+    assert isinstance(data["Metadata_Gene"].dtype, pd.CategoricalDtype)
+    assert data["Metadata_Gene"].tolist()[0] == "gene_a"
+    assert data["Metadata_Gene"].isna().tolist() == [False, True]
+    assert list(data["Metadata_Plate"]) == ["plate_a", "plate_b"]
@@ -1,3 +1,8 @@
+import hashlib
+import os
+import pathlib
+import time
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.lines import Line2D
@@ -5,12 +10,444 @@ from matplotlib.colors import rgb2hex
 import seaborn as sns
 import pandas as pd
 import umap
+import numba
+from joblib import dump
+from pynndescent import NNDescent
+from threadpoolctl import threadpool_limits
+
+from cache_utils import evict_least_recently_used, record_cache_access, touch_cache_entry
+from feature_store_utils import load_feature_store
 
 # make random np operations reproducible
 np.random.seed(0)
 
+# umap finds exact neighbors for data with fewer than this many samples (and ignores precomputed knn graphs)
+UMAP_EXACT_KNN_SAMPLE_LIMIT = 4096
+
+
+def get_umap_cache_key(
+    feature_data: np.ndarray, umap_parameters: dict, chunk_rows: int = 10000
+) -> str:
+    """
+    get cache key for umap embeddings from hash of feature data bytes and umap parameters
+
+    Parameters
+    ----------
+    feature_data : np.ndarray
+        feature data to find embeddings for
+    umap_parameters : dict
+        parameters of umap reducer (ex: n_components, random_state, metric, n_neighbors)
+    chunk_rows : int, optional
+        number of rows of feature data to hash at a time, by default 10000
+
+    Returns
+    -------
+    str
+        hex digest cache key
+    """
+    feature_data = np.asarray(feature_data)
+    umap_hash = hashlib.blake2b(digest_size=16)
+    umap_hash.update(repr((feature_data.shape, feature_data.dtype.str)).encode())
+    umap_hash.update(repr(sorted(umap_parameters.items())).encode())
+
+    # hash feature data in row chunks so non-contiguous views are copied a chunk at a time
+    for start in range(0, feature_data.shape[0], chunk_rows):
+        umap_hash.update(np.ascontiguousarray(feature_data[start : start + chunk_rows]).data)
+
+    return umap_hash.hexdigest()
+
+
+def get_knn_graph(
+    feature_data: np.ndarray,
+    n_neighbors: int = 15,
+    metric: str = "euclidean",
+    random_state: int = 0,
+) -> tuple:
+    """
+    get k nearest neighbors graph of feature data with pynndescent
+    (with the same search settings umap uses to find neighbors)
+
+    Parameters
+    ----------
+    feature_data : np.ndarray
+        feature data to find neighbors for
+    n_neighbors : int, optional
+        number of neighbors to find for each sample, by default 15
+    metric : str, optional
+        distance metric to find neighbors with, by default "euclidean"
+    random_state : int, optional
+        random state for neighbor search, by default 0
+
+    Returns
+    -------
+    tuple
+        knn indices, knn distances, knn search index
+        (can be passed to umap.UMAP as precomputed_knn)
+    """
+    num_samples = feature_data.shape[0]
+    knn_search_index = NNDescent(
+        feature_data,
+        n_neighbors=n_neighbors,
+        metric=metric,
+        random_state=random_state,
+        n_trees=min(64, 5 + int(round(num_samples**0.5 / 20.0))),
+        n_iters=max(5, int(round(np.log2(num_samples)))),
+        max_candidates=60,
+        low_memory=True,
+    )
+    knn_indices, knn_dists = knn_search_index.neighbor_graph
+
+    return knn_indices, knn_dists, knn_search_index
+
+
+def uses_shared_knn_graph(feature_data: np.ndarray, knn_graph: dict = None) -> bool:
+    """
+    check if umap fit of feature data would use shared knn graph
+
+    Parameters
+    ----------
+    feature_data : np.ndarray
+        feature data to find embeddings for
+    knn_graph : dict, optional
+        shared knn graphs of feature data, by default None
+
+    Returns
+    -------
+    bool
+        whether or not a shared knn graph is given and feature data has too many samples
+        for umap to find exact neighbors
+    """
+    return knn_graph is not None and feature_data.shape[0] >= UMAP_EXACT_KNN_SAMPLE_LIMIT
+
+
+def fit_umap_embeddings(
+    feature_data: np.ndarray, umap_parameters: dict, knn_graph: dict = None
+) -> tuple:
+    """
+    fit umap reducer to feature data, reusing shared knn graph if one is given
+    and feature data is large enough for umap to use approximate neighbors
+
+    Parameters
+    ----------
+    feature_data : np.ndarray
+        feature data to find embeddings for
+    umap_parameters : dict
+        parameters of umap reducer (n_components, random_state, metric, n_neighbors)
+    knn_graph : dict, optional
+        shared knn graphs of feature data, with (n_neighbors, metric) as keys,
+        a missing graph is found with get_knn_graph and added to dict, by default None (no sharing)
+
+    Returns
+    -------
+    np.ndarray, umap.UMAP
+        umap embeddings, fitted umap reducer
+    """
+    precomputed_knn = (None, None, None)
+    if uses_shared_knn_graph(feature_data, knn_graph):
+        knn_key = (umap_parameters["n_neighbors"], umap_parameters["metric"])
+        if knn_key not in knn_graph:
+            knn_graph[knn_key] = get_knn_graph(
+                feature_data,
+                umap_parameters["n_neighbors"],
+                umap_parameters["metric"],
+                umap_parameters["random_state"],
+            )
+        precomputed_knn = knn_graph[knn_key]
+
+    reducer = umap.UMAP(**umap_parameters, precomputed_knn=precomputed_knn)
+    embeddings = reducer.fit_transform(feature_data)
+
+    return embeddings, reducer
+
+
+def get_cached_umap_embeddings(
+    feature_data: np.ndarray,
+    n_components: int = 2,
+    random_state: int = 0,
+    metric: str = "euclidean",
+    n_neighbors: int = 15,
+    cache_dir: pathlib.Path = None,
+    save_reducer: bool = False,
+    max_cache_bytes: int = 2**30,
+    knn_graph: dict = None,
+) -> tuple:
+    """
+    get umap embeddings for numpy array, loading them from cache if they were already found
+    for the same feature data and umap parameters
+    cache access is not recorded (see get_umap_embeddings)
+
+    Parameters
+    ----------
+    feature_data : np.ndarray
+        feature data to find embeddings for
+    n_components : int, optional
+        number of umap dimensions, by default 2
+    random_state : int, optional
+        random state for umap embeddings, by default 0
+    metric : str, optional
+        distance metric for umap, by default "euclidean"
+    n_neighbors : int, optional
+        number of neighbors for umap, by default 15
+    cache_dir : pathlib.Path, optional
+        directory to cache embeddings in, by default None (no caching)
+    save_reducer : bool, optional
+        whether or not to also cache fitted umap reducer (as joblib file), by default False
+    max_cache_bytes : int, optional
+        maximum total size of cached umap files, least recently used files
+        are evicted past this size, by default 2**30
+    knn_graph : dict, optional
+        shared knn graphs of feature data (see fit_umap_embeddings), pass the same dict
+        for every embedding of the same feature data so its knn graph is only found once,
+        by default None (each umap fit finds its own knn graph)
+
+    Returns
+    -------
+    np.ndarray, bool
+        umap embeddings with shape (number of samples, n_components),
+        whether embeddings were loaded from cache
+    """
+    umap_parameters = {
+        "n_components": n_components,
+        "random_state": random_state,
+        "metric": metric,
+        "n_neighbors": n_neighbors,
+    }
+
+    if cache_dir is None:
+        return fit_umap_embeddings(feature_data, umap_parameters, knn_graph)[0], False
+
+    # embeddings fit with a shared knn graph can differ slightly from those fit without one
+    cache_key = get_umap_cache_key(
+        feature_data,
+        {**umap_parameters, "shared_knn_graph": uses_shared_knn_graph(feature_data, knn_graph)},
+    )
+    embeddings_path = pathlib.Path(f"{cache_dir}/umap_embeddings__{cache_key}.npy")
+    reducer_path = pathlib.Path(f"{cache_dir}/umap_reducer__{cache_key}.joblib")
+
+    cache_hit = embeddings_path.exists() and (reducer_path.exists() or not save_reducer)
+    if cache_hit:
+        embeddings = np.load(embeddings_path)
+        touch_cache_entry(embeddings_path)
+        if save_reducer:
+            touch_cache_entry(reducer_path)
+    else:
+        embeddings, reducer = fit_umap_embeddings(feature_data, umap_parameters, knn_graph)
+
+        # write to temporary files then rename them so partial files are never loaded
+        pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        temp_path = embeddings_path.with_name(f".{embeddings_path.name}.{os.getpid()}.tmp")
+        with open(temp_path, "wb") as temp_file:
+            np.save(temp_file, embeddings)
+        temp_path.replace(embeddings_path)
+        if save_reducer:
+            temp_path = reducer_path.with_name(f".{reducer_path.name}.{os.getpid()}.tmp")
+            dump(reducer, temp_path)
+            temp_path.replace(reducer_path)
+
+        evict_least_recently_used(cache_dir, "umap_*", max_cache_bytes)
+
+    return embeddings, cache_hit
+
+
+def get_umap_embeddings(
+    feature_data: np.ndarray,
+    n_components: int = 2,
+    random_state: int = 0,
+    metric: str = "euclidean",
+    n_neighbors: int = 15,
+    cache_dir: pathlib.Path = None,
+    save_reducer: bool = False,
+    max_cache_bytes: int = 2**30,
+    knn_graph: dict = None,
+) -> np.ndarray:
+    """
+    get umap embeddings for numpy array, loading them from cache if they were already found
+    for the same feature data and umap parameters, and record cache hit or miss
+
+    Parameters
+    ----------
+    feature_data : np.ndarray
+        feature data to find embeddings for
+    n_components : int, optional
+        number of umap dimensions, by default 2
+    random_state : int, optional
+        random state for umap embeddings, by default 0
+    metric : str, optional
+        distance metric for umap, by default "euclidean"
+    n_neighbors : int, optional
+        number of neighbors for umap, by default 15
+    cache_dir : pathlib.Path, optional
+        directory to cache embeddings in, by default None (no caching)
+    save_reducer : bool, optional
+        whether or not to also cache fitted umap reducer (as joblib file), by default False
+    max_cache_bytes : int, optional
+        maximum total size of cached umap files, least recently used files
+        are evicted past this size, by default 2**30
+    knn_graph : dict, optional
+        shared knn graphs of feature data (see fit_umap_embeddings), by default None
+
+    Returns
+    -------
+    np.ndarray
+        umap embeddings with shape (number of samples, n_components)
+    """
+    embeddings, cache_hit = get_cached_umap_embeddings(
+        feature_data,
+        n_components,
+        random_state,
+        metric,
+        n_neighbors,
+        cache_dir,
+        save_reducer,
+        max_cache_bytes,
+        knn_graph,
+    )
+    if cache_dir is not None:
+        record_cache_access(cache_dir, "umap_embeddings", cache_hit)
+
+    return embeddings
+
+
+def limit_worker_threads(num_threads: int):
+    """
+    limit number of BLAS/OpenMP and numba threads used by a worker process,
+    so parallel workers do not oversubscribe cores
+
+    Parameters
+    ----------
+    num_threads : int
+        maximum number of threads for worker to use
+    """
+    # environment variables are read by BLAS/OpenMP libraries loaded after this point
+    for thread_variable in ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]:
+        os.environ[thread_variable] = str(num_threads)
+    # libraries that are already loaded are limited at runtime
+    # (numba is imported with this module, so NUMBA_NUM_THREADS would have no effect)
+    threadpool_limits(num_threads)
+    numba.set_num_threads(min(num_threads, numba.config.NUMBA_NUM_THREADS))
+
+
+def get_timed_umap_embeddings(
+    job_name,
+    store_path: pathlib.Path,
+    feature_type: str,
+    n_components: int = 2,
+    random_state: int = 0,
+    cache_dir: pathlib.Path = None,
+) -> tuple:
+    """
+    get umap embeddings for one embedding job and time how long it takes
+    feature data is memory-mapped from its feature store, so it is not copied into the worker
+
+    Parameters
+    ----------
+    job_name : hashable
+        name of embedding job (ex: (dataset_type, feature_type))
+    store_path : pathlib.Path
+        path to feature store with feature data to find embeddings for
+    feature_type : str
+        feature block of feature store to find embeddings for,
+        can be "CP", "DP", or "CP_and_DP"
+    n_components : int, optional
+        number of umap dimensions, by default 2
+    random_state : int, optional
+        random state for umap embeddings, by default 0
+    cache_dir : pathlib.Path, optional
+        directory to cache embeddings in, by default None (no caching)
+
+    Returns
+    -------
+    tuple
+        job name, umap embeddings, whether embeddings were loaded from cache, seconds job took
+    """
+    start_time = time.perf_counter()
+    _, feature_blocks, _ = load_feature_store(store_path)
+    embeddings, cache_hit = get_cached_umap_embeddings(
+        feature_blocks[feature_type],
+        n_components=n_components,
+        random_state=random_state,
+        cache_dir=cache_dir,
+    )
+
+    return job_name, embeddings, cache_hit, time.perf_counter() - start_time
+
 
-def get_2D_umap_embeddings(feature_data: np.ndarray, random_state: int = 0):
+def schedule_umap_embeddings(
+    jobs: list,
+    n_components: int = 2,
+    random_state: int = 0,
+    cache_dir: pathlib.Path = None,
+    n_workers: int = None,
+    threads_per_worker: int = None,
+) -> dict:
+    """
+    get umap embeddings for independent embedding jobs in parallel on a process pool
+    and print how long each job took
+    cache hits and misses of all jobs are recorded by this (parent) process
+
+    Parameters
+    ----------
+    jobs : list
+        (job name, feature store path, feature type) tuples for each embedding job
+    n_components : int, optional
+        number of umap dimensions, by default 2
+    random_state : int, optional
+        random state for umap embeddings, by default 0
+    cache_dir : pathlib.Path, optional
+        directory to cache embeddings in, by default None (no caching)
+    n_workers : int, optional
+        number of worker processes, by default None (one per job, up to number of cpus)
+    threads_per_worker : int, optional
+        maximum number of BLAS/numba threads for each worker,
+        by default None (cpus split evenly between workers)
+
+    Returns
+    -------
+    dict
+        job names as keys and umap embeddings as values, in same order as jobs
+    """
+    if n_workers is None:
+        n_workers = max(1, min(len(jobs), os.cpu_count()))
+    if threads_per_worker is None:
+        threads_per_worker = max(1, os.cpu_count() // n_workers)
+
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        initializer=limit_worker_threads,
+        initargs=(threads_per_worker,),
+    ) as executor:
+        futures = [
+            executor.submit(
+                get_timed_umap_embeddings,
+                job_name,
+                store_path,
+                feature_type,
+                n_components,
+                random_state,
+                cache_dir,
+            )
+            for job_name, store_path, feature_type in jobs
+        ]
+        # results are collected in job order (not completion order) so outputs are deterministic
+        job_results = [future.result() for future in futures]
+
+    for job_name, _, cache_hit, job_seconds in job_results:
+        if cache_dir is not None:
+            record_cache_access(cache_dir, "umap_embeddings", cache_hit)
+        print(
+            f"UMAP embedding job {job_name} took {job_seconds:.1f} seconds "
+            f"(cache {'hit' if cache_hit else 'miss'})"
+        )
+
+    return {job_name: embeddings for job_name, embeddings, _, _ in job_results}
+
+
+def get_2D_umap_embeddings(
+    feature_data: np.ndarray,
+    random_state: int = 0,
+    cache_dir: pathlib.Path = None,
+    knn_graph: dict = None,
+):
     """
     get 2D umap embeddings for numpy array as x and y vectors
 
@@ -20,17 +457,24 @@ def get_2D_umap_embeddings(feature_data: np.ndarray, random_state: int = 0):
         feature data to find embeddings for
     random_state : int, optional
         random state for umap embeddings, by default 0
+    cache_dir : pathlib.Path, optional
+        directory to cache embeddings in, by default None (no caching)
+    knn_graph : dict, optional
+        shared knn graphs of feature data (see fit_umap_embeddings), by default None
 
     Returns
     -------
     np.ndarray, np.ndarray
         X data vector, y data vector
     """
-    # create umap object for dimension reduction
-    reducer = umap.UMAP(random_state=random_state, n_components=2)
-
-    # Fit UMAP and extract latent vars 1-2
-    embedding = reducer.fit_transform(feature_data)
+    # Fit UMAP (or load cached embeddings) and extract latent vars 1-2
+    embedding = get_umap_embeddings(
+        feature_data,
+        n_components=2,
+        random_state=random_state,
+        cache_dir=cache_dir,
+        knn_graph=knn_graph,
+    )
     embedding = np.transpose(embedding)
 
     # convert to seaborn-recognizable vectors
@@ -131,6 +575,8 @@ def show_1D_umap(
     save_path=None,
     point_size: int = 5,
     alpha: float = 1,
+    cache_dir: pathlib.Path = None,
+    knn_graph: dict = None,
 ):
     """
     show (and save) 1D umap, colored by metadata
@@ -150,11 +596,20 @@ def show_1D_umap(
         size of umap points, by default 5
     alpha : float, optional
         opacity of umap points,, by default 1
+    cache_dir : pathlib.Path, optional
+        directory to cache umap embeddings in, by default None (no caching)
+    knn_graph : dict, optional
+        shared knn graphs of feature data (see fit_umap_embeddings), by default None
     """
-    # create umap object for dimension reduction
-    reducer = umap.UMAP(random_state=0, n_components=1)
-    # Fit UMAP and extract latent vars
-    embedding = pd.DataFrame(reducer.fit_transform(feature_data), columns=["UMAP1"])
+    # Fit UMAP (or load cached embeddings) and extract latent vars
+    umap_embeddings = get_umap_embeddings(
+        feature_data,
+        n_components=1,
+        random_state=0,
+        cache_dir=cache_dir,
+        knn_graph=knn_graph,
+    )
+    embedding = pd.DataFrame(umap_embeddings, columns=["UMAP1"])
     # add phenotypic class to embeddings
     embedding[metadata_series.name] = metadata_series.tolist()
 
@@ -233,6 +688,9 @@ def show_2D_umap(
     save_path=None,
     point_size: int = 5,
     alpha: float = 1,
+    cache_dir: pathlib.Path = None,
+    knn_graph: dict = None,
+    umap_embeddings: np.ndarray = None,
 ):
     """
     show (and save) 2D umap, colored by metadata
@@ -252,12 +710,25 @@ def show_2D_umap(
         size of umap points, by default 5
     alpha : float, optional
         opacity of umap points,, by default 1
+    cache_dir : pathlib.Path, optional
+        directory to cache umap embeddings in, by default None (no caching)
+    knn_graph : dict, optional
+        shared knn graphs of feature data (see fit_umap_embeddings), by default None
+    umap_embeddings : np.ndarray, optional
+        precomputed 2D umap embeddings of feature data (ex: from schedule_umap_embeddings),
+        by default None (umap is fit or loaded from cache)
     """
-    # create umap object for dimension reduction
-    reducer = umap.UMAP(random_state=0, n_components=2)
-    # Fit UMAP and extract latent vars
+    # Fit UMAP (or load cached embeddings) and extract latent vars
+    if umap_embeddings is None:
+        umap_embeddings = get_umap_embeddings(
+            feature_data,
+            n_components=2,
+            random_state=0,
+            cache_dir=cache_dir,
+            knn_graph=knn_graph,
+        )
     embedding = pd.DataFrame(
-        reducer.fit_transform(feature_data), columns=["UMAP1", "UMAP2"]
+        umap_embeddings, columns=["UMAP1", "UMAP2"]
     )
     # add phenotypic class to embeddings
     embedding[metadata_series.name] = metadata_series.tolist()
@@ -335,6 +806,8 @@ def show_3D_umap(
     save_path=None,
     point_size: int = 5,
     alpha: float = 1,
+    cache_dir: pathlib.Path = None,
+    knn_graph: dict = None,
 ):
     """
     show (and save) 3D umap, colored by metadata
@@ -354,12 +827,21 @@ def show_3D_umap(
         size of umap points, by default 5
     alpha : float, optional
         opacity of umap points,, by default 1
+    cache_dir : pathlib.Path, optional
+        directory to cache umap embeddings in, by default None (no caching)
+    knn_graph : dict, optional
+        shared knn graphs of feature data (see fit_umap_embeddings), by default None
     """
-    # create umap object for dimension reduction
-    reducer = umap.UMAP(random_state=0, n_components=3)
-    # Fit UMAP and extract latent vars
+    # Fit UMAP (or load cached embeddings) and extract latent vars
+    umap_embeddings = get_umap_embeddings(
+        feature_data,
+        n_components=3,
+        random_state=0,
+        cache_dir=cache_dir,
+        knn_graph=knn_graph,
+    )
     embedding = pd.DataFrame(
-        reducer.fit_transform(feature_data), columns=["UMAP1", "UMAP2", "UMAP3"]
+        umap_embeddings, columns=["UMAP1", "UMAP2", "UMAP3"]
     )
     # add phenotypic class to embeddings
     embedding[metadata_series.name] = metadata_series.tolist()
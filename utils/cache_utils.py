@@ -0,0 +1,263 @@
+import hashlib
+import json
+import os
+import pathlib
+from joblib import dump, load
+
+
+def get_file_fingerprint(file_path: pathlib.Path, chunk_size: int = 2**20) -> str:
+    """
+    get fingerprint of a file from its size and content hash
+
+    Parameters
+    ----------
+    file_path : pathlib.Path
+        path to file to fingerprint
+    chunk_size : int, optional
+        number of bytes to hash at a time, by default 2**20
+
+    Returns
+    -------
+    str
+        hex digest fingerprint of file
+    """
+    file_path = pathlib.Path(file_path)
+    file_hash = hashlib.blake2b(digest_size=16)
+    file_hash.update(str(file_path.stat().st_size).encode())
+
+    with open(file_path, "rb") as file:
+        while chunk := file.read(chunk_size):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+
+def get_cached_file_fingerprint(file_path: pathlib.Path, fingerprint_index: dict) -> str:
+    """
+    get fingerprint of a file, reusing its fingerprint from fingerprint index
+    if the file size and mtime have not changed since it was hashed
+
+    Parameters
+    ----------
+    file_path : pathlib.Path
+        path to file to fingerprint
+    fingerprint_index : dict
+        file paths as keys and dicts with size, mtime_ns, and fingerprint as values,
+        updated with fingerprint of file if it had to be hashed
+
+    Returns
+    -------
+    str
+        hex digest fingerprint of file
+    """
+    file_path = pathlib.Path(file_path).resolve()
+    file_stat = file_path.stat()
+
+    index_entry = fingerprint_index.get(str(file_path))
+    if (
+        index_entry is not None
+        and index_entry["size"] == file_stat.st_size
+        and index_entry["mtime_ns"] == file_stat.st_mtime_ns
+    ):
+        return index_entry["fingerprint"]
+
+    fingerprint = get_file_fingerprint(file_path)
+    fingerprint_index[str(file_path)] = {
+        "size": file_stat.st_size,
+        "mtime_ns": file_stat.st_mtime_ns,
+        "fingerprint": fingerprint,
+    }
+
+    return fingerprint
+
+
+def get_files_fingerprint(
+    file_paths: list, keys: list = None, cache_dir: pathlib.Path = None
+) -> str:
+    """
+    get one fingerprint of multiple files (from their names, sizes, and content hashes) and extra keys
+    if cache dir is given, content hashes are reused for files with unchanged sizes and mtimes
+
+    Parameters
+    ----------
+    file_paths : list
+        paths to files to fingerprint
+    keys : list, optional
+        extra values to include in fingerprint (ex: selected feature columns), by default None
+    cache_dir : pathlib.Path, optional
+        directory to keep index of file fingerprints in, by default None (no index)
+
+    Returns
+    -------
+    str
+        hex digest fingerprint of files and keys
+    """
+    fingerprint_index = {}
+    if cache_dir is not None:
+        index_path = pathlib.Path(f"{cache_dir}/file_fingerprints.json")
+        if index_path.exists():
+            fingerprint_index = json.loads(index_path.read_text())
+
+    if keys is None:
+        keys = []
+
+    files_hash = hashlib.blake2b(digest_size=16)
+    for file_path in file_paths:
+        files_hash.update(pathlib.Path(file_path).name.encode())
+        files_hash.update(get_cached_file_fingerprint(file_path, fingerprint_index).encode())
+    for key in keys:
+        files_hash.update(repr(key).encode())
+
+    if cache_dir is not None:
+        # files that no longer exist are removed from index
+        fingerprint_index = {
+            path: index_entry
+            for path, index_entry in fingerprint_index.items()
+            if pathlib.Path(path).exists()
+        }
+        write_json_atomic(fingerprint_index, index_path)
+
+    return files_hash.hexdigest()
+
+
+def write_json_atomic(data: dict, save_path: pathlib.Path):
+    """
+    save dict as json by writing a temporary file then renaming it to save path
+    (temporary file is unique to process, so parallel workers do not collide)
+
+    Parameters
+    ----------
+    data : dict
+        data to save
+    save_path : pathlib.Path
+        path to save json to
+    """
+    save_path = pathlib.Path(save_path)
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = save_path.with_name(f".{save_path.name}.{os.getpid()}.tmp")
+    temp_path.write_text(json.dumps(data, indent=4))
+    temp_path.replace(save_path)
+
+
+def record_cache_access(cache_dir: pathlib.Path, cache_name: str, cache_hit: bool):
+    """
+    record a cache hit or miss in cache stats (cache_stats.json in cache dir)
+
+    Parameters
+    ----------
+    cache_dir : pathlib.Path
+        directory of cache
+    cache_name : str
+        name of cached object (ex: normalization_scaler__ic)
+    cache_hit : bool
+        whether cache access was a hit (True) or a miss (False)
+    """
+    stats_path = pathlib.Path(f"{cache_dir}/cache_stats.json")
+    cache_stats = json.loads(stats_path.read_text()) if stats_path.exists() else {}
+
+    name_stats = cache_stats.setdefault(cache_name, {"hits": 0, "misses": 0})
+    name_stats["hits" if cache_hit else "misses"] += 1
+    write_json_atomic(cache_stats, stats_path)
+
+
+def get_cached_object(
+    cache_dir: pathlib.Path, cache_name: str, cache_key: str, compute_function
+) -> tuple:
+    """
+    load object saved for cache name and key, or compute and save it if there is no such object
+    objects saved for cache name with other keys are stale and are evicted
+
+    Parameters
+    ----------
+    cache_dir : pathlib.Path
+        directory to save cached objects to
+    cache_name : str
+        name of cached object (ex: normalization_scaler__ic)
+    cache_key : str
+        key of cached object (ex: fingerprint of files object is computed from)
+    compute_function : function
+        function with no arguments to compute object with
+
+    Returns
+    -------
+    tuple
+        cached object, whether object was loaded from cache (True) or computed (False)
+    """
+    cache_dir = pathlib.Path(cache_dir)
+    cache_path = pathlib.Path(f"{cache_dir}/{cache_name}__{cache_key}.joblib")
+
+    cache_hit = cache_path.exists()
+    if cache_hit:
+        cached_object = load(cache_path)
+    else:
+        cached_object = compute_function()
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        temp_path = cache_path.with_name(f".{cache_path.name}.{os.getpid()}.tmp")
+        dump(cached_object, temp_path)
+        temp_path.replace(cache_path)
+
+        # evict stale objects saved for cache name with other keys
+        # (keys are hex digests, so names like {cache_name}__other__{key} are not matched)
+        for stale_path in cache_dir.glob(f"{cache_name}__*.joblib"):
+            stale_key = stale_path.name[len(f"{cache_name}__") : -len(".joblib")]
+            if stale_path != cache_path and stale_key.isalnum():
+                stale_path.unlink()
+
+    record_cache_access(cache_dir, cache_name, cache_hit)
+
+    return cached_object, cache_hit
+
+
+def touch_cache_entry(cache_path: pathlib.Path):
+    """
+    mark cache entry as most recently used by updating its mtime
+
+    Parameters
+    ----------
+    cache_path : pathlib.Path
+        path to cache entry
+    """
+    pathlib.Path(cache_path).touch(exist_ok=True)
+
+
+def evict_least_recently_used(
+    cache_dir: pathlib.Path, pattern: str, max_cache_bytes: int
+) -> list:
+    """
+    delete least recently used cache entries (oldest mtimes) matching pattern
+    until the entries matching pattern take up at most max cache bytes
+
+    Parameters
+    ----------
+    cache_dir : pathlib.Path
+        directory of cache
+    pattern : str
+        glob pattern of cache entries to limit size of (ex: umap_*)
+    max_cache_bytes : int
+        maximum total size of cache entries matching pattern
+
+    Returns
+    -------
+    list
+        paths to evicted cache entries
+    """
+    # stat each entry once, other processes may evict entries at the same time
+    cache_entries = []
+    for cache_path in pathlib.Path(cache_dir).glob(pattern):
+        try:
+            cache_stat = cache_path.stat()
+        except FileNotFoundError:
+            continue
+        cache_entries.append((cache_stat.st_mtime_ns, cache_stat.st_size, cache_path))
+    cache_entries.sort(key=lambda cache_entry: cache_entry[0])
+    cache_bytes = sum(cache_size for _, cache_size, _ in cache_entries)
+
+    evicted_paths = []
+    for _, cache_size, cache_path in cache_entries:
+        if cache_bytes <= max_cache_bytes:
+            break
+        cache_bytes -= cache_size
+        cache_path.unlink(missing_ok=True)
+        evicted_paths.append(cache_path)
+
+    return evicted_paths
@@ -0,0 +1,121 @@
+import json
+import pathlib
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from load_utils import get_column_classification
+
+
+def save_feature_store(
+    data: pd.DataFrame, store_path: pathlib.Path, chunk_rows: int = 100000
+) -> pathlib.Path:
+    """
+    save data to a feature store with
+    features.npy: float32 feature matrix (CP block, then DP block) that can be memory-mapped,
+    metadata.parquet: metadata table,
+    manifest.json: metadata and feature column names
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        data to save, ex: normalized mitocheck data
+    store_path : pathlib.Path
+        path to feature store directory, replaced if it already exists
+    chunk_rows : int, optional
+        number of rows to copy into the feature matrix at a time, by default 100000
+
+    Returns
+    -------
+    pathlib.Path
+        path to feature store directory
+    """
+    store_path = pathlib.Path(store_path)
+    column_classification = get_column_classification(tuple(data.columns))
+    feature_cols = list(column_classification["CP_and_DP"])
+
+    # write to temporary directory first so an interrupted write is never used as a store
+    temp_store_path = store_path.with_name(f"{store_path.name}.tmp")
+    if temp_store_path.exists():
+        shutil.rmtree(temp_store_path)
+    temp_store_path.mkdir(parents=True)
+
+    # copy features into the memory-mapped matrix in chunks to avoid a full in-memory copy
+    features = np.lib.format.open_memmap(
+        temp_store_path / "features.npy",
+        mode="w+",
+        dtype=np.float32,
+        shape=(len(data), len(feature_cols)),
+    )
+    feature_positions = [data.columns.get_loc(col) for col in feature_cols]
+    for start in range(0, len(data), chunk_rows):
+        features[start : start + chunk_rows] = data.iloc[
+            start : start + chunk_rows, feature_positions
+        ].to_numpy(dtype=np.float32)
+    features.flush()
+    del features
+
+    metadata = data[list(column_classification["metadata"])].reset_index(drop=True)
+    pq.write_table(
+        pa.Table.from_pandas(metadata, preserve_index=False),
+        temp_store_path / "metadata.parquet",
+    )
+
+    with open(temp_store_path / "manifest.json", "w") as manifest_file:
+        json.dump(
+            {
+                "num_rows": len(data),
+                "dtype": "float32",
+                "metadata_columns": list(column_classification["metadata"]),
+                "CP_columns": list(column_classification["CP"]),
+                "DP_columns": list(column_classification["DP"]),
+            },
+            manifest_file,
+            indent=4,
+        )
+
+    if store_path.exists():
+        shutil.rmtree(store_path)
+    temp_store_path.rename(store_path)
+
+    return store_path
+
+
+def load_feature_store(store_path: pathlib.Path):
+    """
+    open feature store saved with save_feature_store
+    the feature matrix is memory-mapped read-only, so processes opening the same store share its pages
+
+    Parameters
+    ----------
+    store_path : pathlib.Path
+        path to feature store directory
+
+    Returns
+    -------
+    pd.DataFrame, dict, dict
+        metadata dataframe,
+        "CP", "DP", and "CP_and_DP" as keys and memory-mapped feature values as values,
+        manifest of store
+    """
+    store_path = pathlib.Path(store_path)
+    with open(store_path / "manifest.json") as manifest_file:
+        manifest = json.load(manifest_file)
+
+    metadata_dataframe = pq.read_table(
+        store_path / "metadata.parquet", memory_map=True
+    ).to_pandas()
+    features = np.load(store_path / "features.npy", mmap_mode="r")
+    num_cp_cols = len(manifest["CP_columns"])
+
+    return (
+        metadata_dataframe,
+        {
+            "CP": features[:, :num_cp_cols],
+            "DP": features[:, num_cp_cols:],
+            "CP_and_DP": features,
+        },
+        manifest,
+    )
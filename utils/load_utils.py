@@ -1,57 +1,161 @@
+import functools
 import pathlib
+from concurrent.futures import ThreadPoolExecutor
+import duckdb
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
+import pyarrow as pa
+import pyarrow.parquet as pq
 
+# Some CP columns are related to things besides the features we want (ex. location measurements)
+# We only want to get CP data from the feature modules below (__ ensures it is found as module name)
+CP_FEATURE_MODULES = [
+    "__AreaShape_",
+    "__Granularity_",
+    "__Intensity",
+    "__Neighbors",
+    "__RadialDistribution",
+    "__Texture",
+]
 
-def compile_mitocheck_batch_data(
-    data_path: pathlib.Path, dataset: str = "CP_and_DP"
-) -> pd.DataFrame:
+
+def get_batch_paths(data_path: pathlib.Path) -> list:
     """
-    compile batch data from a mitocheck idrstream merged features run
+    get paths to saved batches from a mitocheck idrstream merged features run,
+    in order of batch number
 
     Parameters
     ----------
     data_path : pathlib.Path
         path to folder with saved batches
-        these batches must be merged (have CP and DP features)
-    dataset : str, optional
-        which dataset columns to load in (in addition to metadata),
-        can be "CP" or "DP" or by default "CP_and_DP"
 
     Returns
     -------
-    pd.DataFrame
-        compiled batch dataframe
+    list
+        paths to batches (batch_0.csv.gz, batch_1.csv.gz, ..., batch_10.csv.gz, ...)
     """
+    return sorted(pathlib.Path(data_path).glob("batch_*.csv.gz"), key=get_batch_number)
 
-    data = pd.DataFrame()
 
-    # determine which cols to use for loading (depending on dataset)
-    # load in first row to get all column names
-    batch_0_row_0 = pd.read_csv(
-        f"{data_path}/batch_0.csv.gz",
-        compression="gzip",
-        index_col=0,
-        low_memory=False,
-        nrows=1,
-    )
-    cols_to_load = batch_0_row_0.columns.to_list()
+def get_batch_number(batch_path: pathlib.Path) -> int:
+    """
+    get batch number from path to saved batch, ex: .../batch_12.csv.gz -> 12
+
+    Parameters
+    ----------
+    batch_path : pathlib.Path
+        path to saved batch
+
+    Returns
+    -------
+    int
+        batch number
+    """
+    return int(batch_path.name.split(".")[0].split("_")[1])
+
+
+def get_row_uniforms(
+    sample_seed: int, batch_number: int, row_positions: np.ndarray
+) -> np.ndarray:
+    """
+    get reproducible uniform random values for rows of a batch
+    values are a hash (splitmix64) of the seed, batch number, and row position,
+    so they do not depend on the order batches are read in
+
+    Parameters
+    ----------
+    sample_seed : int
+        seed for random values
+    batch_number : int
+        batch number of rows
+    row_positions : np.ndarray
+        positions of rows in batch
+
+    Returns
+    -------
+    np.ndarray
+        uniform random values in [0, 1) for each row
+    """
+    mask = 2**64 - 1
+    key = (batch_number << 40) + sample_seed * 0xD1B54A32D192ED03
+    with np.errstate(over="ignore"):
+        z = np.asarray(row_positions, dtype=np.uint64) + np.uint64(key & mask)
+        z = z + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> np.uint64(31))
+
+    return (z >> np.uint64(11)) * 2.0**-53
+
+
+def get_sample_row_mask(
+    row_positions: np.ndarray,
+    batch_number: int,
+    sample_frac: float,
+    sample_seed: int,
+    selected_rows: np.ndarray = None,
+) -> np.ndarray:
+    """
+    get mask of sampled rows of a batch
+
+    Parameters
+    ----------
+    row_positions : np.ndarray
+        positions of rows in batch
+    batch_number : int
+        batch number of rows
+    sample_frac : float
+        fraction of rows to sample with bernoulli sampling
+    sample_seed : int
+        seed for bernoulli sampling
+    selected_rows : np.ndarray, optional
+        positions of already selected rows (ex: from stratified sampling),
+        by default None (use bernoulli sampling)
+
+    Returns
+    -------
+    np.ndarray
+        boolean mask with True for sampled rows
+    """
+    if selected_rows is not None:
+        return np.isin(row_positions, selected_rows)
 
+    return get_row_uniforms(sample_seed, batch_number, row_positions) < sample_frac
+
+
+def get_columns_to_load(columns: list, dataset: str = "CP_and_DP") -> list:
+    """
+    get columns to load from all columns of mitocheck idrstream merged features
+
+    Parameters
+    ----------
+    columns : list
+        all column names of merged features
+    dataset : str, optional
+        which dataset columns to load in (in addition to metadata),
+        can be "CP" or "DP" or by default "CP_and_DP"
+
+    Returns
+    -------
+    list
+        columns to load, in order of columns
+    """
     # remove unecessary DP column that isnt part of features
     cols_to_remove = ["DP__Metadata_Model"]
 
-    # Some CP columns are related to things besides the features we want (ex. location measurements)
-    # We only want to get CP data from the feature modules below (__ ensures it is found as module name)
-    cp_feature_modules = ["__AreaShape_", "__Granularity_", "__Intensity", "__Neighbors", "__RadialDistribution", "__Texture"]
     # remove CP columns that dont have a feature module as a substring
-    for col in cols_to_load:
+    for col in columns:
         if "CP__" not in col:
             continue
-        has_feature_module = any(feature_module in col for feature_module in cp_feature_modules)
+        has_feature_module = any(
+            feature_module in col for feature_module in CP_FEATURE_MODULES
+        )
         if not has_feature_module:
             cols_to_remove.append(col)
-    
+
     # remove columns we don't want from the list to load
-    cols_to_load = list(set(cols_to_load) - set(cols_to_remove))
+    cols_to_load = [col for col in columns if col not in set(cols_to_remove)]
 
     # remove DP or CP features from columns to load depending on desired dataset
     if dataset == "CP":
@@ -59,30 +163,791 @@ def compile_mitocheck_batch_data(
     if dataset == "DP":
         cols_to_load = [col for col in cols_to_load if "CP__" not in col]
 
-    print(f"Loading data from {data_path}...")
-    for batch_path in data_path.iterdir():
-        batch = pd.read_csv(
-            batch_path,
+    return cols_to_load
+
+
+def split_well_frame(batch: pd.DataFrame) -> pd.DataFrame:
+    """
+    split idrstream well_frame column into well and frame columns
+
+    Parameters
+    ----------
+    batch : pd.DataFrame
+        batch data with Metadata_Well column in form well_frame
+
+    Returns
+    -------
+    pd.DataFrame
+        batch data with Metadata_Well and Metadata_Frame columns
+    """
+    # batches loaded without the well_frame column (ex: only a stratum column) have nothing to split
+    if "Metadata_Well" not in batch.columns:
+        return batch
+
+    # split without expand so empty batches still get both columns
+    well_frame = batch["Metadata_Well"].str.split("_", n=1)
+    batch["Metadata_Well"] = well_frame.str[0]
+    frame = well_frame.str[1]
+    batch.insert(min(5, len(batch.columns)), "Metadata_Frame", frame)
+
+    return batch
+
+
+def load_batch(
+    batch_path: pathlib.Path, cols_to_load: list, row_mask_function=None
+) -> pd.DataFrame:
+    """
+    load one saved batch from a mitocheck idrstream merged features run
+
+    Parameters
+    ----------
+    batch_path : pathlib.Path
+        path to saved batch
+    cols_to_load : list
+        columns to load from batch
+    row_mask_function : callable, optional
+        function that takes row positions and returns a mask of rows to load,
+        other rows are skipped while parsing, by default None (load all rows)
+
+    Returns
+    -------
+    pd.DataFrame
+        batch dataframe with well and frame columns split
+    """
+    skiprows = None
+    if row_mask_function is not None:
+        # row masks are computed for blocks of rows, rows are parsed in order
+        block_size = 2**16
+        block_masks = {}
+
+        def skip_row(line_number: int) -> bool:
+            # line 0 is the header
+            if line_number == 0:
+                return False
+            block, block_position = divmod(line_number - 1, block_size)
+            if block not in block_masks:
+                block_masks.clear()
+                block_masks[block] = row_mask_function(
+                    np.arange(block * block_size, (block + 1) * block_size)
+                )
+            return not block_masks[block][block_position]
+
+        skiprows = skip_row
+
+    batch = pd.read_csv(
+        batch_path,
+        compression="gzip",
+        low_memory=True,
+        usecols=cols_to_load,
+        skiprows=skiprows,
+    )
+
+    return split_well_frame(batch)
+
+
+def get_memory_usage(data: pd.DataFrame) -> float:
+    """
+    get memory usage of dataframe (including python string objects) in MB
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        dataframe to measure
+
+    Returns
+    -------
+    float
+        memory usage in MB
+    """
+    return data.memory_usage(index=True, deep=True).sum() / 2**20
+
+
+def compact_mitocheck_data(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    convert mitocheck data to compact dtypes:
+    float32 features, integer well and frame columns, and categorical string metadata columns
+    (other metadata columns are not converted)
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        mitocheck data, ex: compiled batch data
+
+    Returns
+    -------
+    pd.DataFrame
+        mitocheck data with compact dtypes
+    """
+    feature_cols = set(get_column_classification(tuple(data.columns))["CP_and_DP"])
+    compact_dtypes = {}
+    for col in data.columns:
+        if col in feature_cols:
+            # features of empty batches are loaded as objects
+            if pd.api.types.is_float_dtype(data[col]) or len(data) == 0:
+                compact_dtypes[col] = np.float32
+        elif col in ["Metadata_Well", "Metadata_Frame"]:
+            compact_dtypes[col] = np.int32
+        # outlines are unique per cell so they are not made categorical
+        elif data[col].dtype == object and "Outline" not in col:
+            non_null_values = data[col].dropna()
+            if len(non_null_values) > 0 and pd.api.types.is_string_dtype(non_null_values):
+                compact_dtypes[col] = "category"
+
+    return data.astype(compact_dtypes, copy=False)
+
+
+def concat_compact_batches(batches: list) -> pd.DataFrame:
+    """
+    concatenate compact batches, keeping categorical columns categorical
+    (pd.concat converts categorical columns with different categories to objects)
+    empty batches are dropped, so their dtypes do not change the dtypes of the result
+
+    Parameters
+    ----------
+    batches : list
+        compact batch dataframes (see compact_mitocheck_data)
+
+    Returns
+    -------
+    pd.DataFrame
+        concatenated batches
+    """
+    if len(batches) == 0:
+        return pd.concat(batches, ignore_index=True)
+    batches = [batch for batch in batches if len(batch) > 0] or batches[:1]
+
+    for col in batches[0].columns:
+        if not any(isinstance(batch[col].dtype, pd.CategoricalDtype) for batch in batches):
+            continue
+        # give every batch the union of the categories of all batches (only codes are remapped)
+        for batch in batches:
+            if not isinstance(batch[col].dtype, pd.CategoricalDtype):
+                # object categories so all-NaN columns do not get float categories
+                batch[col] = batch[col].astype(object).astype("category")
+        categories = union_categoricals([batch[col] for batch in batches]).categories
+        for batch in batches:
+            batch[col] = batch[col].cat.set_categories(categories)
+
+    return pd.concat(batches, ignore_index=True)
+
+
+def get_parquet_store_path(data_path: pathlib.Path) -> pathlib.Path:
+    """
+    get path to parquet feature store of a mitocheck idrstream merged features run
+    ex: .../merged_features -> .../merged_features_parquet
+
+    Parameters
+    ----------
+    data_path : pathlib.Path
+        path to folder with saved batches
+
+    Returns
+    -------
+    pathlib.Path
+        path to folder with parquet feature store batches
+    """
+    data_path = pathlib.Path(data_path)
+
+    return data_path.parent / f"{data_path.name}_parquet"
+
+
+def get_parquet_batch_path(batch_path: pathlib.Path) -> pathlib.Path:
+    """
+    get path to parquet feature store batch for a saved batch
+    ex: .../merged_features/batch_0.csv.gz -> .../merged_features_parquet/batch_0.parquet
+
+    Parameters
+    ----------
+    batch_path : pathlib.Path
+        path to saved batch
+
+    Returns
+    -------
+    pathlib.Path
+        path to parquet feature store batch
+    """
+    batch_name = batch_path.name.split(".")[0]
+
+    return get_parquet_store_path(batch_path.parent) / f"{batch_name}.parquet"
+
+
+def is_parquet_batch_current(batch_path: pathlib.Path) -> bool:
+    """
+    check if parquet feature store batch exists and is newer than its saved batch
+
+    Parameters
+    ----------
+    batch_path : pathlib.Path
+        path to saved batch
+
+    Returns
+    -------
+    bool
+        whether or not parquet batch can be used instead of saved batch
+    """
+    parquet_batch_path = get_parquet_batch_path(batch_path)
+
+    return (
+        parquet_batch_path.exists()
+        and parquet_batch_path.stat().st_mtime >= batch_path.stat().st_mtime
+    )
+
+
+def is_parquet_store_current(batch_paths: list) -> bool:
+    """
+    check if every saved batch has a current parquet feature store batch
+
+    Parameters
+    ----------
+    batch_paths : list
+        paths to saved batches
+
+    Returns
+    -------
+    bool
+        whether or not parquet store can be used instead of saved batches
+    """
+    return len(batch_paths) > 0 and all(
+        is_parquet_batch_current(batch_path) for batch_path in batch_paths
+    )
+
+
+def convert_batch_to_parquet(batch_path: pathlib.Path) -> pathlib.Path:
+    """
+    convert saved batch to a parquet feature store batch
+    store batches have all CP_and_DP columns to load and split well and frame columns
+
+    Parameters
+    ----------
+    batch_path : pathlib.Path
+        path to saved batch
+
+    Returns
+    -------
+    pathlib.Path
+        path to parquet feature store batch
+    """
+    batch_columns = pd.read_csv(
+        batch_path, compression="gzip", index_col=0, nrows=0
+    ).columns.to_list()
+    batch = load_batch(batch_path, get_columns_to_load(batch_columns))
+
+    # write to temporary file first so an interrupted write is never used as a store batch
+    parquet_batch_path = get_parquet_batch_path(batch_path)
+    temp_parquet_batch_path = parquet_batch_path.with_suffix(".parquet.tmp")
+    pq.write_table(pa.Table.from_pandas(batch, preserve_index=False), temp_parquet_batch_path)
+    temp_parquet_batch_path.replace(parquet_batch_path)
+
+    return parquet_batch_path
+
+
+def convert_mitocheck_batch_data_to_parquet(
+    data_path: pathlib.Path, n_workers: int = None
+) -> pathlib.Path:
+    """
+    convert saved batches from a mitocheck idrstream merged features run to a parquet feature store
+    only batches without a current parquet batch are converted
+
+    Parameters
+    ----------
+    data_path : pathlib.Path
+        path to folder with saved batches
+    n_workers : int, optional
+        number of threads to convert batches with,
+        by default None (ThreadPoolExecutor default)
+
+    Returns
+    -------
+    pathlib.Path
+        path to folder with parquet feature store batches
+    """
+    store_path = get_parquet_store_path(data_path)
+    store_path.mkdir(parents=True, exist_ok=True)
+
+    batch_paths = [
+        batch_path
+        for batch_path in get_batch_paths(data_path)
+        if not is_parquet_batch_current(batch_path)
+    ]
+    if len(batch_paths) > 0:
+        print(f"Converting {len(batch_paths)} batches from {data_path} to parquet...")
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            list(executor.map(convert_batch_to_parquet, batch_paths))
+
+    return store_path
+
+
+def load_parquet_batch(
+    batch_path: pathlib.Path, cols_to_load: list, row_mask_function=None
+) -> pd.DataFrame:
+    """
+    load projected columns of one parquet feature store batch
+
+    Parameters
+    ----------
+    batch_path : pathlib.Path
+        path to saved batch the parquet batch was converted from
+    cols_to_load : list
+        columns to load from parquet batch
+    row_mask_function : callable, optional
+        function that takes row positions and returns a mask of rows to load,
+        other rows are dropped from each record batch before conversion to pandas,
+        by default None (load all rows)
+
+    Returns
+    -------
+    pd.DataFrame
+        batch dataframe with well and frame columns split
+    """
+    parquet_batch_path = get_parquet_batch_path(batch_path)
+    if row_mask_function is None:
+        return pq.read_table(
+            parquet_batch_path, columns=cols_to_load, memory_map=True
+        ).to_pandas()
+
+    parquet_batch = pq.ParquetFile(parquet_batch_path, memory_map=True)
+    record_batches = []
+    start = 0
+    for record_batch in parquet_batch.iter_batches(columns=cols_to_load):
+        row_mask = row_mask_function(np.arange(start, start + record_batch.num_rows))
+        record_batches.append(record_batch.filter(pa.array(row_mask)))
+        start += record_batch.num_rows
+
+    if len(record_batches) == 0:
+        return parquet_batch.schema_arrow.empty_table().select(cols_to_load).to_pandas()
+
+    return pa.Table.from_batches(record_batches).to_pandas()
+
+
+def get_sample_row_mask_functions(
+    batch_paths: list,
+    load_function,
+    sample_frac: float,
+    sample_seed: int = 0,
+    stratify_by: str = None,
+) -> list:
+    """
+    get functions that mask the sampled rows of each batch
+    bernoulli sampling keeps each row with probability sample_frac,
+    stratified sampling keeps round(sample_frac * stratum size) rows from each stratum,
+    choosing the rows with the smallest random values (bottom-k reservoir sample)
+
+    Parameters
+    ----------
+    batch_paths : list
+        paths to saved batches
+    load_function : callable
+        function to load columns of a batch with (load_batch or load_parquet_batch)
+    sample_frac : float
+        fraction of rows to sample
+    sample_seed : int, optional
+        seed for sampling, by default 0
+    stratify_by : str, optional
+        column to stratify sample by (ex: "Metadata_Plate" or "Metadata_Gene"),
+        by default None (bernoulli sampling)
+
+    Returns
+    -------
+    list
+        row mask function for each batch
+    """
+    if stratify_by is None:
+        return [
+            functools.partial(
+                get_sample_row_mask,
+                batch_number=get_batch_number(batch_path),
+                sample_frac=sample_frac,
+                sample_seed=sample_seed,
+            )
+            for batch_path in batch_paths
+        ]
+
+    # only load the stratum column to select rows
+    # frames are split from the well_frame column of saved batches, so it is loaded instead
+    stratum_columns = [stratify_by]
+    if stratify_by == "Metadata_Frame" and load_function is load_batch:
+        stratum_columns = ["Metadata_Well"]
+    with ThreadPoolExecutor() as executor:
+        strata = list(
+            executor.map(load_function, batch_paths, [stratum_columns] * len(batch_paths))
+        )
+    rows = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "batch_number": get_batch_number(batch_path),
+                    "row_position": np.arange(len(batch_strata)),
+                    "stratum": batch_strata[stratify_by].to_numpy(),
+                    "uniform": get_row_uniforms(
+                        sample_seed,
+                        get_batch_number(batch_path),
+                        np.arange(len(batch_strata)),
+                    ),
+                }
+            )
+            for batch_path, batch_strata in zip(batch_paths, strata)
+        ],
+        ignore_index=True,
+    )
+
+    # keep rows with the smallest random values in each stratum
+    stratum_sizes = rows.groupby("stratum", dropna=False)["uniform"].transform("size")
+    stratum_ranks = rows.groupby("stratum", dropna=False)["uniform"].rank(method="first")
+    rows = rows.loc[stratum_ranks <= (stratum_sizes * sample_frac).round()]
+
+    return [
+        functools.partial(
+            get_sample_row_mask,
+            batch_number=get_batch_number(batch_path),
+            sample_frac=sample_frac,
+            sample_seed=sample_seed,
+            selected_rows=rows.loc[
+                rows["batch_number"] == get_batch_number(batch_path), "row_position"
+            ].to_numpy(),
+        )
+        for batch_path in batch_paths
+    ]
+
+
+def compile_mitocheck_batch_data(
+    data_path: pathlib.Path,
+    dataset: str = "CP_and_DP",
+    n_workers: int = None,
+    use_parquet_store: bool = False,
+    compact: bool = False,
+    sample_frac: float = None,
+    sample_seed: int = 0,
+    stratify_by: str = None,
+) -> pd.DataFrame:
+    """
+    compile batch data from a mitocheck idrstream merged features run
+
+    Parameters
+    ----------
+    data_path : pathlib.Path
+        path to folder with saved batches
+        these batches must be merged (have CP and DP features)
+    dataset : str, optional
+        which dataset columns to load in (in addition to metadata),
+        can be "CP" or "DP" or by default "CP_and_DP"
+    n_workers : int, optional
+        number of threads to decode batches with,
+        by default None (ThreadPoolExecutor default)
+    use_parquet_store : bool, optional
+        whether or not to load batches from an existing parquet feature store
+        (see convert_mitocheck_batch_data_to_parquet), saved batches are loaded
+        if the store is missing or outdated, by default False
+    compact : bool, optional
+        whether or not to convert batches to compact dtypes while loading
+        (see compact_mitocheck_data) and print a memory usage report, by default False
+    sample_frac : float, optional
+        fraction of rows to sample while loading, rows that are not sampled are never loaded,
+        by default None (load all rows)
+    sample_seed : int, optional
+        seed for sampling, the sample only depends on the seed and batch contents
+        (not the order batches are read in), by default 0
+    stratify_by : str, optional
+        column to stratify sample by (ex: "Metadata_Plate" or "Metadata_Gene"),
+        by default None (bernoulli sampling of each row)
+
+    Returns
+    -------
+    pd.DataFrame
+        compiled batch dataframe, batches are in order of batch number
+    """
+    batch_paths = get_batch_paths(data_path)
+
+    # the store is never created here, only used if it already exists
+    if use_parquet_store and not is_parquet_store_current(batch_paths):
+        print(f"No current parquet feature store for {data_path}, loading saved batches...")
+        use_parquet_store = False
+
+    if use_parquet_store:
+        # only the projected columns are read from the store
+        store_columns = pq.read_schema(get_parquet_batch_path(batch_paths[0])).names
+        cols_to_load = get_columns_to_load(store_columns, dataset)
+        load_function = load_parquet_batch
+    else:
+        # determine which cols to use for loading (depending on dataset)
+        # load in first row to get all column names
+        batch_0_row_0 = pd.read_csv(
+            f"{data_path}/batch_0.csv.gz",
             compression="gzip",
-            low_memory=True,
-            usecols=cols_to_load,
+            index_col=0,
+            low_memory=False,
+            nrows=1,
+        )
+        cols_to_load = get_columns_to_load(batch_0_row_0.columns.to_list(), dataset)
+        load_function = load_batch
+
+    if sample_frac is None:
+        row_mask_functions = [None] * len(batch_paths)
+    else:
+        row_mask_functions = get_sample_row_mask_functions(
+            batch_paths, load_function, sample_frac, sample_seed, stratify_by
         )
 
-        # split well_frame into well and frame columns
-        batch[["Metadata_Well", "Metadata_Frame"]] = batch["Metadata_Well"].str.split(
-            "_", expand=True
+    # measure memory usage of each batch before and after it is compacted
+    batch_memory_usages = []
+
+    def load_compact_batch(
+        batch_path: pathlib.Path, cols_to_load: list, row_mask_function
+    ):
+        batch = load_function(batch_path, cols_to_load, row_mask_function)
+        memory_usage = get_memory_usage(batch)
+        batch = compact_mitocheck_data(batch)
+        batch_memory_usages.append((memory_usage, get_memory_usage(batch)))
+        return batch
+
+    print(f"Loading data from {data_path}...")
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        batches = list(
+            executor.map(
+                load_compact_batch if compact else load_function,
+                batch_paths,
+                [cols_to_load] * len(batch_paths),
+                row_mask_functions,
+            )
         )
-        batch.insert(5, "Metadata_Frame", batch.pop("Metadata_Frame"))
 
-        if data.empty:
-            data = batch
+    if not compact:
+        return pd.concat(batches, ignore_index=True)
+
+    # categories are unified across batches so compact columns stay compact when concatenated
+    data = concat_compact_batches(batches)
+    memory_usage = sum(usage for usage, _ in batch_memory_usages)
+    print(
+        f"Compact data uses {get_memory_usage(data):.1f} MB "
+        f"(batches used {memory_usage:.1f} MB before compacting)"
+    )
+
+    return data
+
+
+def iter_mitocheck_batches(
+    data_path: pathlib.Path,
+    dataset: str = "CP_and_DP",
+    columns: list = None,
+    chunk_rows: int = 100000,
+    use_parquet_store: bool = False,
+    compact: bool = False,
+):
+    """
+    iterate over bounded-size chunks of batch data from a mitocheck idrstream merged features run
+    chunks have the same columns as compile_mitocheck_batch_data, so they can be processed out-of-core
+
+    Parameters
+    ----------
+    data_path : pathlib.Path
+        path to folder with saved batches or path to one saved batch
+        these batches must be merged (have CP and DP features)
+    dataset : str, optional
+        which dataset columns to load in (in addition to metadata),
+        can be "CP" or "DP" or by default "CP_and_DP"
+    columns : list, optional
+        only load these columns from the dataset columns (in order of columns),
+        by default None (all dataset columns)
+    chunk_rows : int, optional
+        maximum number of rows in each chunk, by default 100000
+    use_parquet_store : bool, optional
+        whether or not to load batches from an existing parquet feature store
+        (see convert_mitocheck_batch_data_to_parquet), saved batches are loaded
+        if the store is missing or outdated, by default False
+    compact : bool, optional
+        whether or not to convert chunks to compact dtypes (see compact_mitocheck_data),
+        by default False
+
+    Yields
+    ------
+    pd.DataFrame
+        chunk of batch data with at most chunk_rows rows, chunks are in order of batch number
+    """
+    data_path = pathlib.Path(data_path)
+    batch_paths = get_batch_paths(data_path) if data_path.is_dir() else [data_path]
+
+    # the store is never created here, only used if it already exists
+    if use_parquet_store and not is_parquet_store_current(batch_paths):
+        use_parquet_store = False
+
+    for batch_path in batch_paths:
+        if use_parquet_store:
+            parquet_batch = pq.ParquetFile(get_parquet_batch_path(batch_path))
+            cols_to_load = get_columns_to_load(parquet_batch.schema_arrow.names, dataset)
+        else:
+            batch_columns = pd.read_csv(
+                batch_path, compression="gzip", index_col=0, nrows=0
+            ).columns.to_list()
+            cols_to_load = get_columns_to_load(batch_columns, dataset)
+        if columns is not None:
+            # well and frame are loaded together from a saved batch (as well_frame)
+            cols_to_load = [
+                col
+                for col in cols_to_load
+                if col in set(columns)
+                or (col == "Metadata_Well" and not use_parquet_store)
+            ]
+
+        if use_parquet_store:
+            chunks = (
+                record_batch.to_pandas()
+                for record_batch in parquet_batch.iter_batches(
+                    batch_size=chunk_rows, columns=cols_to_load
+                )
+            )
         else:
-            data = pd.concat([data, batch])
+            chunks = (
+                split_well_frame(chunk.reset_index(drop=True))
+                for chunk in pd.read_csv(
+                    batch_path,
+                    compression="gzip",
+                    usecols=cols_to_load,
+                    chunksize=chunk_rows,
+                )
+            )
+        if columns is not None:
+            # both backends return the requested columns in the requested order
+            chunks = (
+                chunk[[col for col in columns if col in chunk.columns]] for chunk in chunks
+            )
 
-    return data.reset_index(drop=True)
+        for chunk in chunks:
+            yield compact_mitocheck_data(chunk) if compact else chunk
 
 
-def split_data(pycytominer_output: pd.DataFrame, dataset: str = "CP_and_DP"):
+def get_mitocheck_batch_relation(
+    data_path: pathlib.Path,
+    dataset: str = "CP_and_DP",
+    columns: list = None,
+    plates: list = None,
+    wells: list = None,
+    genes: list = None,
+    frames: list = None,
+    sample_frac: float = None,
+    sample_seed: int = 0,
+    connection: duckdb.DuckDBPyConnection = None,
+) -> duckdb.DuckDBPyRelation:
+    """
+    get lazy duckdb relation over the parquet feature store of a mitocheck idrstream merged features run
+    column selection, row filters, and sampling are pushed down to the parquet scan
+    and nothing is loaded until the relation is materialized (ex: with .df() or .arrow())
+
+    Parameters
+    ----------
+    data_path : pathlib.Path
+        path to folder with saved batches
+        these batches must be merged (have CP and DP features)
+    dataset : str, optional
+        which dataset columns to select (in addition to metadata),
+        can be "CP" or "DP" or by default "CP_and_DP"
+    columns : list, optional
+        only select these columns from the dataset columns, by default None (all dataset columns)
+    plates : list, optional
+        only select cells from these plates, by default None (all plates)
+    wells : list, optional
+        only select cells from these wells, by default None (all wells)
+    genes : list, optional
+        only select cells with these genes, by default None (all genes)
+    frames : list, optional
+        only select cells from these frames, by default None (all frames)
+    sample_frac : float, optional
+        fraction of cells to select with bernoulli sampling, by default None (no sampling)
+    sample_seed : int, optional
+        seed for bernoulli sampling, by default 0,
+        samples are only reproducible if the connection uses one thread
+    connection : duckdb.DuckDBPyConnection, optional
+        duckdb connection to create relation with, by default None (new in-memory connection)
+
+    Returns
+    -------
+    duckdb.DuckDBPyRelation
+        lazy relation with selected cells and columns
+
+    Raises
+    ------
+    ValueError
+        if the parquet feature store is missing or outdated
+    """
+    batch_paths = get_batch_paths(data_path)
+    if not is_parquet_store_current(batch_paths):
+        raise ValueError(
+            f"No current parquet feature store for {data_path}, "
+            "create it with convert_mitocheck_batch_data_to_parquet"
+        )
+    parquet_batch_paths = [
+        str(get_parquet_batch_path(batch_path)) for batch_path in batch_paths
+    ]
+    if connection is None:
+        connection = duckdb.connect()
+
+    # select dataset columns (or the requested subset of them)
+    store_columns = pq.read_schema(parquet_batch_paths[0]).names
+    cols_to_load = get_columns_to_load(store_columns, dataset)
+    if columns is not None:
+        cols_to_load = [col for col in cols_to_load if col in set(columns)]
+
+    def quote_identifier(identifier: str) -> str:
+        return '"' + str(identifier).replace('"', '""') + '"'
+
+    def quote_literal(literal) -> str:
+        return "'" + str(literal).replace("'", "''") + "'"
+
+    # filter rows by metadata values (well and frame are stored as strings)
+    conditions = []
+    for column, values in [
+        ("Metadata_Plate", plates),
+        ("Metadata_Well", wells),
+        ("Metadata_Gene", genes),
+        ("Metadata_Frame", frames),
+    ]:
+        if values is None:
+            continue
+        values = ", ".join(quote_literal(value) for value in values)
+        conditions.append(f"{quote_identifier(column)} IN ({values})")
+
+    query = f"""
+        SELECT {", ".join(quote_identifier(col) for col in cols_to_load)}
+        FROM read_parquet([{", ".join(quote_literal(path) for path in parquet_batch_paths)}])
+        """
+    if len(conditions) > 0:
+        query += f"WHERE {' AND '.join(conditions)}\n"
+    if sample_frac is not None:
+        query += f"USING SAMPLE {sample_frac * 100}% (bernoulli, {sample_seed})\n"
+
+    return connection.sql(query)
+
+
+@functools.lru_cache(maxsize=32)
+def get_column_classification(columns: tuple) -> dict:
+    """
+    classify columns of pycytominer output as metadata, CP feature, or DP feature columns
+    classifications are cached per schema (tuple of column names)
+
+    Parameters
+    ----------
+    columns : tuple
+        all column names of pycytominer output
+
+    Returns
+    -------
+    dict
+        "metadata", "CP", "DP", and "CP_and_DP" as keys and tuples of column names as values,
+        "CP_and_DP" is the CP columns followed by the DP columns
+    """
+    cp_cols = tuple(col for col in columns if "CP__" in col)
+    dp_cols = tuple(col for col in columns if "DP__" in col)
+
+    return {
+        # metadata columns is all columns except feature columns
+        "metadata": tuple(col for col in columns if "P__" not in col),
+        "CP": cp_cols,
+        "DP": dp_cols,
+        "CP_and_DP": cp_cols + dp_cols,
+    }
+
+
+def split_data(
+    pycytominer_output: pd.DataFrame, dataset: str = "CP_and_DP", compact: bool = False
+):
     """
     split pycytominer output to metadata dataframe and np array of feature values
 
@@ -93,26 +958,19 @@ def split_data(pycytominer_output: pd.DataFrame, dataset: str = "CP_and_DP"):
     dataset : str, optional
         which dataset features to split,
         can be "CP" or "DP" or by default "CP_and_DP"
+    compact : bool, optional
+        whether or not to return float32 feature values, by default False
 
     Returns
     -------
     pd.Dataframe, np.ndarray
         metadata dataframe, feature values
     """
-    all_cols = pycytominer_output.columns.tolist()
+    column_classification = get_column_classification(tuple(pycytominer_output.columns))
 
-    # get DP,CP, or both features from all columns depending on desired dataset
-    if dataset == "CP":
-        feature_cols = [col for col in all_cols if "CP__" in col]
-    elif dataset == "DP":
-        feature_cols = [col for col in all_cols if "DP__" in col]
-    elif dataset == "CP_and_DP":
-        feature_cols = [col for col in all_cols if "P__" in col]
-
-    # metadata columns is all columns except feature columns
-    metadata_cols = [col for col in all_cols if "P__" not in col]
-
-    metadata_dataframe = pycytominer_output[metadata_cols]
-    feature_data = pycytominer_output[feature_cols].values
+    metadata_dataframe = pycytominer_output[list(column_classification["metadata"])]
+    feature_data = pycytominer_output[list(column_classification[dataset])].to_numpy(
+        dtype=np.float32 if compact else None
+    )
 
     return metadata_dataframe, feature_data
@@ -3,35 +3,108 @@ import pathlib
 import re
 import numpy as np
 
-import warnings
-from pandas.core.common import SettingWithCopyWarning
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 
+from cache_utils import get_file_fingerprint
+from samples_utils import load_features_samples
 
-def get_frame_metadata(frame_details: str):
+# IDR study annotations columns used to locate data
+ANNOTATION_COLUMNS = [
+    "Plate",
+    "Well",
+    "Well Number",
+    "Control Type",
+    "Plate Issues",
+    "Original Gene Target",
+]
+
+
+def get_annotations_sidecar_path(
+    annotations_path: pathlib.Path, cache_dir: pathlib.Path = None
+) -> pathlib.Path:
     """
-    get frame metadata from features samples movie details string
+    get path to typed parquet sidecar of IDR study annotations file
+    the sidecar is created the first time it is requested for an annotations file
+    and is keyed by the annotations file fingerprint, so it is recreated if the file changes
 
     Parameters
     ----------
-    frame_details : str
-        string from one line of features samples file
-        ex: PLLT0010_27--ex2005_05_13--sp2005_03_23--tt17--c5___P00173_01___T00082___X0397___Y0618
+    annotations_path : pathlib.Path
+        path to IDR study annotations file
+    cache_dir : pathlib.Path, optional
+        directory to save parquet sidecars in,
+        by default None (.cache directory next to annotations file)
 
     Returns
     -------
-    plate: str
-        plate of sample
-    well_num: int
-        well number of sample
-    frame: int
-        frame of sample
+    pathlib.Path
+        path to parquet sidecar with ANNOTATION_COLUMNS
     """
+    annotations_path = pathlib.Path(annotations_path)
+    if cache_dir is None:
+        cache_dir = annotations_path.parent / ".cache"
+
+    fingerprint = get_file_fingerprint(annotations_path)
+    sidecar_prefix = f"{annotations_path.name.split('.')[0]}__"
+    sidecar_path = pathlib.Path(f"{cache_dir}/{sidecar_prefix}{fingerprint}.parquet")
 
-    plate = frame_details.split("--")[0].replace("PL", "")
-    well_num = int(frame_details.split("___")[1][1:6])
-    frame = int(frame_details.split("___")[2][1:6]) + 1
+    if not sidecar_path.exists():
+        print(f"Creating annotations sidecar {sidecar_path}...")
+        annotations = pd.read_csv(
+            annotations_path,
+            usecols=ANNOTATION_COLUMNS,
+            dtype={
+                "Plate": str,
+                "Well": str,
+                "Well Number": int,
+                "Control Type": str,
+                "Plate Issues": str,
+                "Original Gene Target": str,
+            },
+        )
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # remove sidecars from previous versions of the annotations file
+        for stale_sidecar_path in cache_dir.glob(f"{sidecar_prefix}*.parquet"):
+            stale_sidecar_path.unlink()
+        # write to temporary file first so an interrupted write is never used as a sidecar
+        temp_sidecar_path = sidecar_path.with_suffix(".parquet.tmp")
+        pq.write_table(
+            pa.Table.from_pandas(annotations, preserve_index=False), temp_sidecar_path
+        )
+        temp_sidecar_path.replace(sidecar_path)
+
+    return sidecar_path
+
+
+def load_annotations(
+    annotations_path: pathlib.Path, columns: list = None, cache_dir: pathlib.Path = None
+) -> pd.DataFrame:
+    """
+    load IDR study annotations from the typed parquet sidecar of the annotations file
 
-    return plate, well_num, frame
+    Parameters
+    ----------
+    annotations_path : pathlib.Path
+        path to IDR study annotations file
+    columns : list, optional
+        annotation columns to load, by default None (all of ANNOTATION_COLUMNS)
+    cache_dir : pathlib.Path, optional
+        directory to save parquet sidecars in,
+        by default None (.cache directory next to annotations file)
+
+    Returns
+    -------
+    pd.DataFrame
+        IDR study annotations
+    """
+    if columns is None:
+        columns = ANNOTATION_COLUMNS
+    sidecar_path = get_annotations_sidecar_path(annotations_path, cache_dir)
+
+    return pq.read_table(sidecar_path, columns=columns, memory_map=True).to_pandas()
 
 
 def get_uncompiled_training_locations(
@@ -53,47 +126,47 @@ def get_uncompiled_training_locations(
     pd.DataFrame
         dataframe with one entry per features samples file (may have repeats)
     """
-    annotations = pd.read_csv(annotations_path, low_memory=False)
+    annotations = load_annotations(
+        annotations_path,
+        columns=["Plate", "Well", "Well Number", "Plate Issues", "Original Gene Target"],
+    )
     # remove annotations for plates that are missing
     annotations = annotations.loc[annotations["Plate Issues"] != "plate missing"]
-    training_data_locations = []
-
-    with open(feature_samples_path) as labels_file:
-        for line in labels_file:
-            # get plate, well_num, and frame info from feature samples file line
-            frame_details = line.strip().split("\t")[1]
-            plate, well_num, frame = get_frame_metadata(frame_details)
-
-            # get gene and well info from IDR study annotations file
-            image_annotations = annotations.loc[
-                (annotations["Plate"] == plate)
-                & (annotations["Well Number"] == well_num)
-            ]
-            try:
-                gene = image_annotations.iloc[0]["Original Gene Target"]
-                # na gene corresponds to failed QC test (no gene is provided in annotations)
-                # still useful for manually labeled individual cells, just means the whole well failed QC
-                if pd.isna(gene):
-                    gene = "failed QC"
-
-                well = image_annotations.iloc[0]["Well"]
-            except IndexError:
-                # Some labeled data did not make it to IDR because of quality control issues
-                print(f"Image from {plate}, {well_num} not in IDR")
-                continue
-
-            # compile frame details into pandas dataframe to append to all training data locations
-            frame_details = {
-                "Plate": plate,
-                "Well": well,
-                "Well Number": well_num,
-                "Frames": frame,
-                "Original Gene Target": gene,
-            }
-
-            training_data_locations.append(frame_details)
-
-    return pd.DataFrame(training_data_locations)
+    # index annotations once by plate and well number
+    # only the first annotation for each plate/well combination is used
+    annotations = annotations.drop_duplicates(subset=["Plate", "Well Number"])
+    annotations = annotations.set_index(["Plate", "Well Number"])[
+        ["Well", "Original Gene Target"]
+    ]
+
+    # get plate, well_num, and frame info from all feature samples file lines
+    training_data_locations = load_features_samples(feature_samples_path)[
+        ["plate", "well_num", "frame"]
+    ].set_axis(["Plate", "Well Number", "Frames"], axis=1)
+
+    # get gene and well info from IDR study annotations file with one join
+    in_idr = pd.MultiIndex.from_frame(
+        training_data_locations[["Plate", "Well Number"]]
+    ).isin(annotations.index)
+    training_data_locations = training_data_locations.join(
+        annotations, on=["Plate", "Well Number"]
+    )
+    # na gene corresponds to failed QC test (no gene is provided in annotations)
+    # still useful for manually labeled individual cells, just means the whole well failed QC
+    training_data_locations["Original Gene Target"] = training_data_locations[
+        "Original Gene Target"
+    ].fillna("failed QC")
+
+    # Some labeled data did not make it to IDR because of quality control issues
+    for plate, well_num in training_data_locations.loc[
+        ~in_idr, ["Plate", "Well Number"]
+    ].itertuples(index=False):
+        print(f"Image from {plate}, {well_num} not in IDR")
+    training_data_locations = training_data_locations.loc[in_idr]
+
+    return training_data_locations[
+        ["Plate", "Well", "Well Number", "Frames", "Original Gene Target"]
+    ].reset_index(drop=True)
 
 
 def get_final_training_locations(
@@ -141,6 +214,107 @@ def get_final_training_locations(
     return final_training_locations
 
 
+def get_controls_locations(
+    annotations_path: pathlib.Path, control_types_seeds: dict
+) -> dict:
+    """
+    get location data for multiple types of mitocheck controls with one annotations scan
+
+    Parameters
+    ----------
+    annotations_path : pathlib.Path
+        path to IDR curated annotations file
+    control_types_seeds : dict
+        control types ("negative" or "positive") as keys and
+        seeds to use for np.random as values, seeds ensure reproducibility
+
+    Returns
+    -------
+    dict
+        control types as keys and location data for those controls as values
+    """
+    sidecar_path = get_annotations_sidecar_path(annotations_path)
+
+    # remove annotations for plates that are missing
+    # remove annotations for plates with irregular illumination
+    # remove empty wells and wells that are not the desired controls
+    plate_issues = pc.field("Plate Issues")
+    well = pc.field("Well")
+    control_type = pc.field("Control Type")
+    control_filter = (
+        (plate_issues.is_null() | (plate_issues != "plate missing"))
+        & (well.is_null() | (well != "A1"))
+        & control_type.is_valid()
+        & (control_type != "empty well")
+    )
+    control_type_filter = None
+    for desired_control_type in control_types_seeds:
+        has_control_type = pc.match_substring_regex(
+            control_type, pattern=desired_control_type
+        )
+        if control_type_filter is None:
+            control_type_filter = has_control_type
+        else:
+            control_type_filter = control_type_filter | has_control_type
+
+    control_annotations = (
+        ds.dataset(sidecar_path, format="parquet")
+        .to_table(
+            columns=[
+                "Plate",
+                "Well",
+                "Well Number",
+                "Original Gene Target",
+                "Control Type",
+            ],
+            filter=control_filter & control_type_filter,
+        )
+        .to_pandas()
+    )
+
+    controls_locations = {}
+    for desired_control_type, numpy_seed in control_types_seeds.items():
+        control_locations = control_annotations.loc[
+            control_annotations["Control Type"].str.contains(desired_control_type),
+            ["Plate", "Well", "Well Number", "Original Gene Target"],
+        ].reset_index(drop=True)
+        # nan gene values correspond to negative control
+        control_locations["Original Gene Target"] = control_locations[
+            "Original Gene Target"
+        ].fillna("negative control")
+
+        # get random frame in middle third of mitosis movies (between frames 31 and 62)
+        np.random.seed(numpy_seed)
+        frames = np.random.randint(low=31, high=63, size=len(control_locations))
+        control_locations["Frames"] = frames
+
+        # add columns necessary for idrstream_cp
+        # plate map name is plate_wellNum
+        control_locations["Plate_Map_Name"] = (
+            control_locations["Plate"]
+            + "_"
+            + control_locations["Well Number"].astype(str)
+        )
+        # gene replicate and site always 1 for this data
+        control_locations["Gene_Replicate"] = 1
+        control_locations["Site"] = 1
+        # DNA is path to DNA image after image is downloaded and saved with IDR_stream
+        control_locations["DNA"] = (
+            control_locations["Plate"]
+            + "/"
+            + control_locations["Plate"]
+            + "_"
+            + control_locations["Well Number"].astype(str)
+            + "_"
+            + control_locations["Frames"].astype(str)
+            + ".tif"
+        )
+
+        controls_locations[desired_control_type] = control_locations
+
+    return controls_locations
+
+
 def get_control_locations(
     annotations_path: pathlib.Path, control_type: str, numpy_seed: int
 ) -> pd.DataFrame:
@@ -159,55 +333,6 @@ def get_control_locations(
     pd.DataFrame
         location data for controls
     """
-    annotations = pd.read_csv(annotations_path, compression="gzip", dtype=object)
-    # remove annotations for plates that are missing
-    annotations = annotations.loc[
-        annotations["Plate Issues"] != "plate missing"
-    ]  # remove annotations for plates with irregular illumination
-    annotations = annotations.loc[annotations["Well"] != "A1"]
-
-    control_annotations = annotations.loc[annotations["Control Type"].notnull()]
-    control_annotations = control_annotations.loc[
-        control_annotations["Control Type"] != "empty well"
-    ]
-    control_annotations = control_annotations.loc[
-        control_annotations["Control Type"].str.contains(control_type)
+    return get_controls_locations(annotations_path, {control_type: numpy_seed})[
+        control_type
     ]
-
-    # filter warning when setting with copy
-    warnings.simplefilter(action="ignore", category=SettingWithCopyWarning)
-
-    control_locations = control_annotations[
-        ["Plate", "Well", "Well Number", "Original Gene Target"]
-    ]
-    # nan gene values correspond to negative control
-    control_locations["Original Gene Target"] = control_locations[
-        "Original Gene Target"
-    ].fillna("negative control")
-
-    # get random frame in middle third of mitosis movies (between frames 31 and 62)
-    np.random.seed(numpy_seed)
-    frames = np.random.randint(low=31, high=63, size=len(control_locations))
-    control_locations["Frames"] = frames
-
-    # add columns necessary for idrstream_cp
-    # plate map name is plate_wellNum
-    control_locations["Plate_Map_Name"] = (
-        control_locations["Plate"] + "_" + control_locations["Well Number"]
-    )
-    # gene replicate and site always 1 for this data
-    control_locations["Gene_Replicate"] = 1
-    control_locations["Site"] = 1
-    # DNA is path to DNA image after image is downloaded and saved with IDR_stream
-    control_locations["DNA"] = (
-        control_locations["Plate"]
-        + "/"
-        + control_locations["Plate"]
-        + "_"
-        + control_locations["Well Number"]
-        + "_"
-        + control_locations["Frames"].astype(str)
-        + ".tif"
-    )
-
-    return control_locations.reset_index(drop=True)
@@ -1,13 +1,144 @@
+import gzip
 import pathlib
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 from sklearn.preprocessing import StandardScaler
 
-from load_utils import compile_mitocheck_batch_data, split_data
+from cache_utils import get_cached_object, get_files_fingerprint
+from load_utils import (
+    compile_mitocheck_batch_data,
+    get_batch_paths,
+    get_column_classification,
+    get_columns_to_load,
+    iter_mitocheck_batches,
+    split_data,
+)
+
+
+def merge_feature_statistics(statistics_a: tuple, statistics_b: tuple) -> tuple:
+    """
+    merge per-feature count, mean, and sum of squared differences from the mean (M2)
+    of two sets of samples with Chan et al.'s parallel algorithm
+
+    Parameters
+    ----------
+    statistics_a : tuple
+        (count, mean, M2) np.ndarrays for first set of samples
+    statistics_b : tuple
+        (count, mean, M2) np.ndarrays for second set of samples
+
+    Returns
+    -------
+    tuple
+        (count, mean, M2) np.ndarrays for both sets of samples
+    """
+    count_a, mean_a, m2_a = statistics_a
+    count_b, mean_b, m2_b = statistics_b
+
+    count = count_a + count_b
+    # features without any samples yet keep a mean and M2 of 0
+    weight_b = np.divide(count_b, count, out=np.zeros_like(mean_a), where=count > 0)
+    delta = mean_b - mean_a
+    mean = mean_a + delta * weight_b
+    m2 = m2_a + m2_b + delta**2 * count_a * weight_b
+
+    return count, mean, m2
+
+
+def get_feature_statistics(
+    batch_path: pathlib.Path, dataset: str = "CP_and_DP", chunk_rows: int = 100000
+) -> tuple:
+    """
+    get per-feature count, mean, and M2 of one saved batch by streaming its chunks
+    nan feature values are ignored (as they are by StandardScaler)
+
+    Parameters
+    ----------
+    batch_path : pathlib.Path
+        path to saved batch
+    dataset : str, optional
+        which dataset features to use,
+        can be "CP" or "DP" or by default "CP_and_DP"
+    chunk_rows : int, optional
+        maximum number of rows to load at a time, by default 100000
+
+    Returns
+    -------
+    tuple
+        (count, mean, M2) np.ndarrays for batch, None if batch has no rows
+    """
+    statistics = None
+    for chunk in iter_mitocheck_batches(
+        batch_path, dataset, chunk_rows=chunk_rows, use_parquet_store=True
+    ):
+        _, feature_data = split_data(chunk, dataset)
+        feature_data = feature_data.astype(np.float64, copy=False)
+
+        # get statistics of chunk, then merge them with statistics of previous chunks
+        count = np.sum(~np.isnan(feature_data), axis=0).astype(np.float64)
+        mean = np.divide(
+            np.nansum(feature_data, axis=0),
+            count,
+            out=np.zeros(feature_data.shape[1]),
+            where=count > 0,
+        )
+        m2 = np.nansum((feature_data - mean) ** 2, axis=0)
+        if statistics is None:
+            statistics = (count, mean, m2)
+        else:
+            statistics = merge_feature_statistics(statistics, (count, mean, m2))
+
+    return statistics
+
+
+def get_scaler_from_statistics(statistics: tuple) -> StandardScaler:
+    """
+    get fitted StandardScaler from per-feature count, mean, and M2
+    constant features get a scale of 1 (as they do in StandardScaler.fit)
+
+    Parameters
+    ----------
+    statistics : tuple
+        (count, mean, M2) np.ndarrays for normalization population
+
+    Returns
+    -------
+    StandardScaler
+        scaler to be used for data normalization
+    """
+    count, mean, m2 = statistics
+    var = np.divide(m2, count, out=np.zeros_like(m2), where=count > 0)
+
+    # features with variance below the floating point error bound of their mean are constant
+    eps = np.finfo(np.float64).eps
+    constant_mask = var <= count * eps * var + (count * mean * eps) ** 2
+    scale = np.sqrt(var)
+    scale[constant_mask] = 1.0
+
+    scaler = StandardScaler()
+    scaler.n_features_in_ = len(mean)
+    # StandardScaler uses a single sample count if no features have nan values
+    if np.all(count == count[0]):
+        scaler.n_samples_seen_ = np.int64(count[0])
+    else:
+        scaler.n_samples_seen_ = count.astype(np.int64)
+    scaler.mean_ = mean
+    scaler.var_ = var
+    scaler.scale_ = scale
+
+    return scaler
 
 
 def get_normalization_scaler(
-    norm_pop_path: pathlib.Path, dataset: str = "CP_and_DP"
+    norm_pop_path: pathlib.Path,
+    dataset: str = "CP_and_DP",
+    compact: bool = False,
+    streaming: bool = False,
+    chunk_rows: int = 100000,
+    n_workers: int = None,
 ) -> StandardScaler():
     """
     get normalization scaler from a normalization population
@@ -19,28 +150,148 @@ def get_normalization_scaler(
     dataset : str, optional
         which dataset columns to load in (in addition to metadata),
         can be "CP" or "DP" or by default "CP_and_DP"
+    compact : bool, optional
+        whether or not to load normalization population with compact dtypes
+        (float32 features, categorical metadata), by default False
+    streaming : bool, optional
+        whether or not to fit scaler incrementally over streamed batch chunks
+        instead of loading the whole normalization population, by default False
+    chunk_rows : int, optional
+        maximum number of rows to load at a time from each batch when streaming,
+        by default 100000
+    n_workers : int, optional
+        number of threads to get batch statistics with when streaming,
+        by default None (ThreadPoolExecutor default)
 
     Returns
     -------
     StandardScaler
         scaler to be used for data normalization
     """
+    if streaming:
+        # get statistics of each batch in parallel, then merge them
+        # (batches are read from the parquet feature store if it already exists)
+        batch_paths = get_batch_paths(norm_pop_path)
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            batch_statistics = list(
+                executor.map(
+                    get_feature_statistics,
+                    batch_paths,
+                    [dataset] * len(batch_paths),
+                    [chunk_rows] * len(batch_paths),
+                )
+            )
+        # batches without any rows have no statistics
+        batch_statistics = [
+            statistics for statistics in batch_statistics if statistics is not None
+        ]
+        if len(batch_statistics) == 0:
+            raise ValueError(f"No normalization population rows found in {norm_pop_path}")
+        statistics = batch_statistics[0]
+        for other_statistics in batch_statistics[1:]:
+            statistics = merge_feature_statistics(statistics, other_statistics)
+
+        return get_scaler_from_statistics(statistics)
+
     # get normalization population
-    norm_pop_data = compile_mitocheck_batch_data(norm_pop_path, dataset)
+    norm_pop_data = compile_mitocheck_batch_data(
+        norm_pop_path, dataset, use_parquet_store=True, compact=compact
+    )
 
     # derive normalization scaler
-    _, norm_pop_feature_data = split_data(norm_pop_data, dataset)
+    _, norm_pop_feature_data = split_data(norm_pop_data, dataset, compact=compact)
     scaler = StandardScaler()
     scaler.fit(norm_pop_feature_data)
 
     return scaler
 
 
+def get_cached_normalization_scaler(
+    norm_pop_path: pathlib.Path,
+    cache_dir: pathlib.Path,
+    cache_name: str = "normalization_scaler",
+    dataset: str = "CP_and_DP",
+    compact: bool = False,
+    streaming: bool = False,
+    chunk_rows: int = 100000,
+    n_workers: int = None,
+) -> tuple:
+    """
+    get normalization scaler from a normalization population,
+    loading it from cache if it was already fit with the same batches and feature columns
+    cache key is a fingerprint of the batch files (names and content hashes),
+    the selected feature columns, and the fit options
+    (sizes and mtimes only decide if a batch's content hash has to be recomputed)
+
+    Parameters
+    ----------
+    norm_pop_path : pathlib.Path
+        path to normalization output in form of mitocheck IDR stream output
+    cache_dir : pathlib.Path
+        directory to cache fitted scalers in
+    cache_name : str, optional
+        name of cached scaler (ex: normalization_scaler__ic), by default "normalization_scaler"
+    dataset : str, optional
+        which dataset columns to load in (in addition to metadata),
+        can be "CP" or "DP" or by default "CP_and_DP"
+    compact : bool, optional
+        whether or not to load normalization population with compact dtypes, by default False
+    streaming : bool, optional
+        whether or not to fit scaler incrementally over streamed batch chunks, by default False
+    chunk_rows : int, optional
+        maximum number of rows to load at a time from each batch when streaming,
+        by default 100000
+    n_workers : int, optional
+        number of threads to get batch statistics with when streaming,
+        by default None (ThreadPoolExecutor default)
+
+    Returns
+    -------
+    tuple
+        scaler to be used for data normalization,
+        whether scaler was loaded from cache (True) or fit (False)
+
+    Raises
+    ------
+    ValueError
+        if there are no saved batches in normalization population path
+    """
+    # key on the feature columns that are actually selected for loading (see get_columns_to_load)
+    batch_paths = get_batch_paths(norm_pop_path)
+    if len(batch_paths) == 0:
+        raise ValueError(f"No normalization population batches found in {norm_pop_path}")
+    batch_columns = pd.read_csv(
+        batch_paths[0], compression="gzip", index_col=0, nrows=0
+    ).columns.to_list()
+    cols_to_load = get_columns_to_load(batch_columns, dataset)
+    feature_columns = get_column_classification(tuple(cols_to_load))[dataset]
+
+    cache_key = get_files_fingerprint(
+        batch_paths, [feature_columns, compact, streaming], cache_dir
+    )
+    normalization_scaler, cache_hit = get_cached_object(
+        cache_dir,
+        cache_name,
+        cache_key,
+        lambda: get_normalization_scaler(
+            norm_pop_path, dataset, compact, streaming, chunk_rows, n_workers
+        ),
+    )
+    print(f"Normalization scaler cache {'hit' if cache_hit else 'miss'} for {cache_name}")
+
+    return normalization_scaler, cache_hit
+
+
 def get_normalized_mitocheck_data(
-    data: pd.DataFrame, scaler: StandardScaler()
+    data: pd.DataFrame,
+    scaler: StandardScaler(),
+    compact: bool = False,
+    chunk_rows: int = 100000,
 ) -> pd.DataFrame:
     """
     get normalized version of mitocheck data
+    features are normalized chunk by chunk into one preallocated buffer,
+    so only one extra copy of the features is made
 
     Parameters
     ----------
@@ -48,23 +299,310 @@ def get_normalized_mitocheck_data(
         data to be normalized, in form of compiled mitocheck IDR output
     scaler : StandardScaler
         scaler to use for data normalization
+    compact : bool, optional
+        whether or not to return float32 normalized features, by default False
+    chunk_rows : int, optional
+        number of rows to normalize at a time, by default 100000
+
+    Returns
+    -------
+    pd.DataFrame
+        normalized data (with same index as data)
+    """
+    # features are in the order the scaler was fit with (CP columns, then DP columns)
+    column_classification = get_column_classification(tuple(data.columns))
+    derived_features = list(column_classification["CP_and_DP"])
+    feature_positions = data.columns.get_indexer(derived_features)
+
+    mean = scaler.mean_ if scaler.with_mean else 0.0
+    scale = scaler.scale_ if scaler.with_std else 1.0
+
+    # copy each chunk of features into buffer, then normalize it in place
+    features = np.empty(
+        (len(data), len(derived_features)), dtype=np.float32 if compact else np.float64
+    )
+    for start in range(0, len(data), chunk_rows):
+        features_chunk = features[start : start + chunk_rows]
+        features_chunk[:] = data.iloc[start : start + chunk_rows, feature_positions]
+        np.subtract(features_chunk, mean, out=features_chunk, casting="same_kind")
+        np.divide(features_chunk, scale, out=features_chunk, casting="same_kind")
+
+    # make features a dataframe (without copying buffer) so it can be combined with metadata
+    features = pd.DataFrame(
+        features, columns=derived_features, index=data.index, copy=False
+    )
+
+    # replace original features of data with normalized features
+    metadata = data[list(column_classification["metadata"])]
+
+    return pd.concat([metadata, features], axis=1, copy=False)
+
+
+def get_grouped_normalization_statistics(
+    norm_pop_data: pd.DataFrame,
+    group_columns: list = None,
+    dataset: str = "CP_and_DP",
+    method: str = "standardize",
+) -> pd.DataFrame:
+    """
+    get per-group normalization statistics (center and scale of each feature)
+    from a normalization population in one grouped pass
+
+    Parameters
+    ----------
+    norm_pop_data : pd.DataFrame
+        normalization population, in form of compiled mitocheck IDR output
+    group_columns : list, optional
+        metadata columns to group normalization population by,
+        by default None (["Metadata_Plate"])
+    dataset : str, optional
+        which dataset features to get statistics for,
+        can be "CP" or "DP" or by default "CP_and_DP"
+    method : str, optional
+        "robustize" for median and MAD (scaled to be consistent with std of normal data),
+        by default "standardize" for mean and std
+
+    Returns
+    -------
+    pd.DataFrame
+        statistics table with group columns, Normalization_Statistic column ("center" or "scale"),
+        and feature columns, with a center row and a scale row for each group
+    """
+    if group_columns is None:
+        group_columns = ["Metadata_Plate"]
+
+    # rows without group values are not part of any group
+    norm_pop_data = norm_pop_data.dropna(subset=group_columns)
+    feature_columns = list(get_column_classification(tuple(norm_pop_data.columns))[dataset])
+    feature_data = norm_pop_data[feature_columns].astype(np.float64)
+    grouped_features = feature_data.groupby(
+        [norm_pop_data[col] for col in group_columns], observed=True, sort=True
+    )
+
+    if method == "standardize":
+        center = grouped_features.mean()
+        scale = grouped_features.std(ddof=0).to_numpy()
+    elif method == "robustize":
+        center = grouped_features.median()
+        # broadcast each group's medians to its rows to get absolute deviations
+        group_codes = grouped_features.ngroup().to_numpy()
+        absolute_deviations = np.abs(
+            feature_data.to_numpy() - center.to_numpy()[group_codes]
+        )
+        scale = (
+            pd.DataFrame(absolute_deviations).groupby(group_codes, sort=True).median()
+        ).to_numpy() * 1.4826
+    else:
+        raise ValueError(f"Normalization method must be standardize or robustize: {method}")
+
+    # constant features (and features of single sample groups) get a scale of 1
+    scale[~(scale > np.finfo(np.float64).eps * np.abs(center.to_numpy()))] = 1.0
+    scale = pd.DataFrame(scale, index=center.index, columns=feature_columns)
+
+    statistics = pd.concat([center, scale], keys=["center", "scale"], names=["Normalization_Statistic"])
+    statistics = statistics.reset_index()
+
+    return statistics[group_columns + ["Normalization_Statistic"] + feature_columns]
+
+
+def save_grouped_normalization_statistics(
+    statistics: pd.DataFrame, save_path: pathlib.Path
+) -> pathlib.Path:
+    """
+    save per-group normalization statistics table as parquet for reuse
+
+    Parameters
+    ----------
+    statistics : pd.DataFrame
+        statistics table from get_grouped_normalization_statistics
+    save_path : pathlib.Path
+        path to save statistics table to (ex: scaler/plate_statistics__ic.parquet)
+
+    Returns
+    -------
+    pathlib.Path
+        path statistics table was saved to
+    """
+    save_path = pathlib.Path(save_path)
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+    statistics.to_parquet(save_path, index=False)
+
+    return save_path
+
+
+def load_grouped_normalization_statistics(statistics_path: pathlib.Path) -> pd.DataFrame:
+    """
+    load per-group normalization statistics table saved with save_grouped_normalization_statistics
+
+    Parameters
+    ----------
+    statistics_path : pathlib.Path
+        path to saved statistics table
+
+    Returns
+    -------
+    pd.DataFrame
+        statistics table with group columns, Normalization_Statistic column, and feature columns
+    """
+    return pd.read_parquet(statistics_path)
+
+
+def get_grouped_normalized_mitocheck_data(
+    data: pd.DataFrame, statistics: pd.DataFrame, compact: bool = False
+) -> pd.DataFrame:
+    """
+    get normalized version of mitocheck data with the statistics of each row's group
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        data to be normalized, in form of compiled mitocheck IDR output
+    statistics : pd.DataFrame
+        statistics table from get_grouped_normalization_statistics
+    compact : bool, optional
+        whether or not to return float32 normalized features, by default False
 
     Returns
     -------
     pd.DataFrame
         normalized data
     """
+    statistics_classification = get_column_classification(tuple(statistics.columns))
+    feature_columns = list(statistics_classification["CP_and_DP"])
+    group_columns = [
+        col for col in statistics_classification["metadata"] if col != "Normalization_Statistic"
+    ]
+
+    center = statistics[statistics["Normalization_Statistic"] == "center"]
+    scale = statistics[statistics["Normalization_Statistic"] == "scale"]
 
-    # normalize features from data
-    col_list = data.columns.tolist()
-    derived_features = [col_name for col_name in col_list if "P__" in col_name]
-    features = data[derived_features].to_numpy()
-    features = scaler.transform(features)
-    # make features a dataframe so it can be combined with metadata
-    features = pd.DataFrame(features, columns=derived_features)
+    # find row of statistics for each row of data (group values are compared as strings)
+    statistics_groups = pd.MultiIndex.from_frame(center[group_columns].astype(str))
+    data_groups = pd.MultiIndex.from_frame(data[group_columns].astype(str))
+    group_positions = statistics_groups.get_indexer(data_groups)
+    if np.any(group_positions == -1):
+        missing_groups = data_groups[group_positions == -1].unique().tolist()
+        raise ValueError(f"No normalization statistics for groups: {missing_groups}")
+
+    # normalize features of all groups with one broadcast
+    features = data[feature_columns].to_numpy(dtype=np.float64)
+    features -= center[feature_columns].to_numpy()[group_positions]
+    features /= scale[feature_columns].to_numpy()[group_positions]
+    if compact:
+        features = features.astype(np.float32)
+    features = pd.DataFrame(features, columns=feature_columns, index=data.index)
 
     # replace original features of data with normalized features
-    metadata = [col_name for col_name in col_list if "P__" not in col_name]
+    metadata = [col_name for col_name in data.columns if "P__" not in col_name]
     metadata = data[metadata]
 
     return pd.concat([metadata, features], axis=1)
+
+
+def get_normalized_parquet_schema(schema: pa.Schema, compact: bool = False) -> pa.Schema:
+    """
+    get explicit schema to write all chunks of normalized data with
+    features are always floats and metadata columns that are all null in the
+    first chunk are strings, so later chunks can be cast to this schema
+
+    Parameters
+    ----------
+    schema : pa.Schema
+        schema inferred from first normalized chunk
+    compact : bool, optional
+        whether or not normalized features are float32, by default False
+
+    Returns
+    -------
+    pa.Schema
+        schema for normalized data
+    """
+    feature_type = pa.float32() if compact else pa.float64()
+    fields = []
+    for field in schema:
+        if "P__" in field.name:
+            field = field.with_type(feature_type)
+        elif pa.types.is_null(field.type):
+            field = field.with_type(pa.string())
+        fields.append(field)
+
+    return pa.schema(fields, metadata=schema.metadata)
+
+
+def write_normalized_mitocheck_data(
+    data_path: pathlib.Path,
+    scaler: StandardScaler(),
+    save_path: pathlib.Path,
+    dataset: str = "CP_and_DP",
+    chunk_rows: int = 100000,
+    compact: bool = False,
+) -> pathlib.Path:
+    """
+    normalize mitocheck data chunk by chunk and append each normalized chunk to save path
+    at most chunk_rows rows are in memory at a time, so memory use is bounded by chunk_rows
+
+    Parameters
+    ----------
+    data_path : pathlib.Path
+        data to be normalized, either path to folder with saved batches from
+        a mitocheck idrstream merged features run or path to a csv.gz file
+        with an index column (ex: formatted training data)
+    scaler : StandardScaler
+        scaler to use for data normalization
+    save_path : pathlib.Path
+        path to save normalized data to, must end with .parquet or .csv.gz
+    dataset : str, optional
+        which dataset columns to load from saved batches (in addition to metadata),
+        can be "CP" or "DP" or by default "CP_and_DP"
+    chunk_rows : int, optional
+        maximum number of rows to normalize at a time, by default 100000
+    compact : bool, optional
+        whether or not to save float32 normalized features, by default False
+
+    Returns
+    -------
+    pathlib.Path
+        path normalized data was saved to
+    """
+    data_path = pathlib.Path(data_path)
+    save_path = pathlib.Path(save_path)
+
+    # saved batches have no index, formatted csv.gz files have an index column
+    if data_path.is_dir():
+        chunks = iter_mitocheck_batches(
+            data_path, dataset, chunk_rows=chunk_rows, use_parquet_store=True
+        )
+        save_index = False
+    else:
+        chunks = pd.read_csv(
+            data_path, compression="gzip", index_col=0, chunksize=chunk_rows
+        )
+        save_index = True
+
+    if save_path.name.endswith(".parquet"):
+        parquet_writer = None
+        for chunk in chunks:
+            normalized_chunk = pa.Table.from_pandas(
+                get_normalized_mitocheck_data(chunk, scaler, compact),
+                preserve_index=save_index,
+            )
+            # all chunks are written with an explicit schema derived from the first chunk
+            if parquet_writer is None:
+                parquet_writer = pq.ParquetWriter(
+                    save_path, get_normalized_parquet_schema(normalized_chunk.schema, compact)
+                )
+            parquet_writer.write_table(normalized_chunk.cast(parquet_writer.schema))
+        if parquet_writer is not None:
+            parquet_writer.close()
+
+    elif save_path.name.endswith(".csv.gz"):
+        with gzip.open(save_path, "wt", newline="") as save_file:
+            for chunk_index, chunk in enumerate(chunks):
+                get_normalized_mitocheck_data(chunk, scaler, compact).to_csv(
+                    save_file, header=chunk_index == 0, index=save_index
+                )
+
+    else:
+        raise ValueError(f"Normalized data must be saved to .parquet or .csv.gz: {save_path}")
+
+    return save_path
@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# compact outlines are stored as a list of (x, y) int16 coordinate pairs per cell
+OUTLINE_TYPE = pa.list_(pa.list_(pa.int16(), 2))
+
+
+def decode_outline_strings(raw_outlines: list) -> tuple:
+    """
+    decode outline strings (printed numpy arrays) extracted with IDR stream
+    ex: "[[397 618]\\n [398 617]\\n [399 617]]"
+
+    Parameters
+    ----------
+    raw_outlines : list
+        strings of outline data for each cell
+
+    Returns
+    -------
+    np.ndarray, np.ndarray
+        int16 coordinates of all outlines with shape (n_coords, 2),
+        offsets of each outline in coordinates with shape (n_outlines + 1,)
+
+    Raises
+    ------
+    ValueError
+        if an outline is missing, the number of decoded values does not match the outline strings,
+        or a coordinate does not fit in int16
+    """
+    raw_outlines = pd.Series(raw_outlines, dtype=object)
+    if raw_outlines.isna().any():
+        raise ValueError(f"{raw_outlines.isna().sum()} outline strings are missing")
+
+    # each outline string has one opening bracket per coordinate plus one for the whole array
+    coord_counts = raw_outlines.str.count(r"\[").to_numpy() - 1
+    offsets = np.zeros(len(raw_outlines) + 1, dtype=np.int64)
+    np.cumsum(coord_counts, out=offsets[1:])
+
+    # parse all coordinates at once after removing brackets
+    all_outlines = " ".join(raw_outlines).translate(str.maketrans("[]", "  "))
+    coords = np.array(all_outlines.split(), dtype=np.int64)
+    if len(coords) != 2 * offsets[-1]:
+        raise ValueError(
+            f"Decoded {len(coords)} values from outline strings, expected {2 * offsets[-1]}"
+        )
+    int16_info = np.iinfo(np.int16)
+    if len(coords) > 0 and (coords.min() < int16_info.min or coords.max() > int16_info.max):
+        raise ValueError(
+            f"Outline coordinates from {coords.min()} to {coords.max()} do not fit in int16"
+        )
+
+    return coords.astype(np.int16).reshape(-1, 2), offsets
+
+
+def encode_outlines(coords: np.ndarray, offsets: np.ndarray) -> pa.ListArray:
+    """
+    encode outline coordinates as a compact arrow list column
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        coordinates of all outlines with shape (n_coords, 2)
+    offsets : np.ndarray
+        offsets of each outline in coordinates with shape (n_outlines + 1,)
+
+    Returns
+    -------
+    pa.ListArray
+        outlines with type OUTLINE_TYPE
+    """
+    coord_pairs = pa.FixedSizeListArray.from_arrays(
+        pa.array(np.ascontiguousarray(coords, dtype=np.int16).ravel()), 2
+    )
+
+    return pa.ListArray.from_arrays(pa.array(offsets, type=pa.int32()), coord_pairs)
+
+
+def decode_outline_array(outline_array: pa.Array) -> tuple:
+    """
+    decode compact arrow outlines without copying coordinates
+
+    Parameters
+    ----------
+    outline_array : pa.Array
+        outlines with type OUTLINE_TYPE, may be chunked
+
+    Returns
+    -------
+    np.ndarray, np.ndarray
+        int16 coordinates of all outlines with shape (n_coords, 2),
+        offsets of each outline in coordinates with shape (n_outlines + 1,)
+    """
+    if isinstance(outline_array, pa.ChunkedArray):
+        outline_array = outline_array.combine_chunks()
+
+    offsets = outline_array.offsets.to_numpy().astype(np.int64)
+    offsets -= offsets[0]
+    coords = outline_array.flatten().flatten().to_numpy().reshape(-1, 2)
+
+    return coords, offsets
+
+
+def load_outlines(outlines) -> tuple:
+    """
+    load outline coordinates from either compact arrow outlines or outline strings
+
+    Parameters
+    ----------
+    outlines : pa.Array, pa.ChunkedArray, pd.Series, or list
+        compact arrow outlines or strings of outline data for each cell
+
+    Returns
+    -------
+    np.ndarray, np.ndarray
+        int16 coordinates of all outlines with shape (n_coords, 2),
+        offsets of each outline in coordinates with shape (n_outlines + 1,)
+    """
+    if isinstance(outlines, (pa.Array, pa.ChunkedArray)):
+        return decode_outline_array(outlines)
+
+    return decode_outline_strings(outlines)
+
+
+def get_compact_outlines_table(
+    data: pd.DataFrame, outlines_column: str = "Metadata_Object_Outline"
+) -> pa.Table:
+    """
+    convert dataframe with outline strings to arrow table with compact outlines
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        data with outline strings, ex: formatted training data
+    outlines_column : str, optional
+        name of column in data that has outline data, by default "Metadata_Object_Outline"
+
+    Returns
+    -------
+    pa.Table
+        data with outlines column of type OUTLINE_TYPE
+    """
+    table = pa.Table.from_pandas(data.drop(columns=outlines_column))
+    outlines = encode_outlines(*decode_outline_strings(data[outlines_column]))
+
+    return table.add_column(
+        data.columns.get_loc(outlines_column),
+        pa.field(outlines_column, OUTLINE_TYPE),
+        outlines,
+    )
@@ -0,0 +1,61 @@
+import pathlib
+import re
+import pandas as pd
+
+# pattern for features samples movie details strings
+# ex: PLLT0010_27--ex2005_05_13--sp2005_03_23--tt17--c5___P00173_01___T00082___X0397___Y0618
+FRAME_DETAILS_PATTERN = re.compile(
+    r"^PL(?P<plate>.+?)--.*?"
+    r"___P(?P<well_num>\d{5}).*?"
+    r"___T(?P<frame>\d{5}).*?"
+    r"___X(?P<center_x>\d+)"
+    r"___Y(?P<center_y>\d+)"
+)
+
+
+def load_features_samples(features_samples_path: pathlib.Path) -> pd.DataFrame:
+    """
+    load features samples file with movie details strings parsed into typed columns
+
+    Parameters
+    ----------
+    features_samples_path : pathlib.Path
+        path to features samples file (no column names),
+        each line has a phenotypic class and movie details string separated by a tab
+
+    Returns
+    -------
+    pd.DataFrame
+        dataframe with one row per features samples file line and columns
+        phenotypic_class, plate, well_num, frame, center_x, center_y
+
+    Raises
+    ------
+    ValueError
+        if a movie details string does not match the expected format
+    """
+    samples = pd.read_csv(
+        features_samples_path,
+        sep="\t",
+        header=None,
+        names=["phenotypic_class", "frame_details"],
+        dtype=str,
+    )
+
+    # extract all movie details in one pass
+    frame_details = samples["frame_details"].str.strip()
+    frame_metadata = frame_details.str.extract(FRAME_DETAILS_PATTERN)
+    malformed = frame_metadata["plate"].isna()
+    if malformed.any():
+        raise ValueError(
+            f"Could not parse movie details string: {frame_details[malformed].iloc[0]}"
+        )
+
+    frame_metadata = frame_metadata.astype(
+        {"well_num": int, "frame": int, "center_x": int, "center_y": int}
+    )
+    # movie details frames are offset by one from IDR frames
+    frame_metadata["frame"] += 1
+    frame_metadata.insert(0, "phenotypic_class", samples["phenotypic_class"].str.strip())
+
+    return frame_metadata
@@ -1,97 +1,176 @@
 import pathlib
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
-from shapely.geometry import Point
-from shapely.geometry.polygon import Polygon
+import pyarrow as pa
+import shapely
 
+from outline_utils import decode_outline_strings, load_outlines
+from samples_utils import load_features_samples
 
-def get_frame_metadata(frame_details: str):
+
+def parse_outline_data(raw_outline_data: str) -> np.array:
     """
-    get frame metadata from features samples movie details string
+    parse outline data extracted with IDR stream into numpy array format
 
     Parameters
     ----------
-    frame_details : str
-        string from one line of features samples file
-        ex: PLLT0010_27--ex2005_05_13--sp2005_03_23--tt17--c5___P00173_01___T00082___X0397___Y0618
+    raw_outline_data : str
+        string of outline data
 
     Returns
     -------
-    plate: str
-        plate of sample
-    well_num: int
-        well number of sample
-    frame: int
-        frame of sample
-    center_x: int
-        center x coord of cell
-    center_y: int
-        center y coord of cell
+    np.array
+        parsed outline data
     """
+    outline_data, _ = decode_outline_strings([raw_outline_data])
 
-    plate = frame_details.split("--")[0].replace("PL", "")
-    well_num = int(frame_details.split("___")[1][1:6])
-    frame = int(frame_details.split("___")[2][1:6]) + 1
-    center_x = int(frame_details.split("___")[3][1:])
-    center_y = int(frame_details.split("___")[4][1:])
+    return outline_data
 
-    return plate, well_num, frame, center_x, center_y
 
+def get_outline_polygons(outlines) -> np.ndarray:
+    """
+    build shapely polygons for all outlines of a frame in one shot
 
-def parse_outline_data(raw_outline_data: str) -> np.array:
+    Parameters
+    ----------
+    outlines : pa.Array, pa.ChunkedArray, pd.Series, or list
+        compact arrow outlines or strings of outline data for each cell
+
+    Returns
+    -------
+    np.ndarray
+        shapely polygon for each outline
     """
-    parse outline data extracted with IDR stream into numpy array format
+    coords, offsets = load_outlines(outlines)
+    ring_indices = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+    return shapely.polygons(shapely.linearrings(coords, indices=ring_indices))
+
+
+def match_centers_to_polygons(
+    centers_x: np.ndarray, centers_y: np.ndarray, polygons: np.ndarray
+) -> np.ndarray:
+    """
+    find first polygon that contains each center with vectorized predicates
+    candidate polygons are prefiltered with their bounding boxes
 
     Parameters
     ----------
-    raw_outline_data : str
-        string of outline data
+    centers_x : np.ndarray
+        x coords of cell centers
+    centers_y : np.ndarray
+        y coords of cell centers
+    polygons : np.ndarray
+        shapely polygons of cell outlines
 
     Returns
     -------
-    np.array
-        parsed outline data
+    np.ndarray
+        position of first polygon that contains each center, -1 if no polygon contains center
     """
-    outline_data = []
+    matches = np.full(len(centers_x), -1)
+    if len(polygons) == 0:
+        return matches
+
+    # only centers inside a polygon's bounding box can be inside that polygon
+    min_x, min_y, max_x, max_y = shapely.bounds(polygons).T
+    centers_x = np.asarray(centers_x)[:, np.newaxis]
+    centers_y = np.asarray(centers_y)[:, np.newaxis]
+    center_positions, polygon_positions = np.nonzero(
+        (min_x <= centers_x)
+        & (centers_x <= max_x)
+        & (min_y <= centers_y)
+        & (centers_y <= max_y)
+    )
+
+    # test all remaining center/polygon pairs at once
+    contained = shapely.contains_xy(
+        polygons[polygon_positions],
+        centers_x[center_positions, 0],
+        centers_y[center_positions, 0],
+    )
+    center_positions = center_positions[contained]
+    polygon_positions = polygon_positions[contained]
 
-    raw_outline_data = raw_outline_data[1:-1]
-    raw_outline_data = raw_outline_data.split("\n ")
-    for coord_string in raw_outline_data:
-        x = int(coord_string[1:-1].split()[0])
-        y = int(coord_string[1:-1].split()[1])
-        outline_data.append([x, y])
+    # pairs are ordered by center then polygon, so the first pair for a center is its first match
+    matched_centers, first_pairs = np.unique(center_positions, return_index=True)
+    matches[matched_centers] = polygon_positions[first_pairs]
 
-    return np.array(outline_data)
+    return matches
 
 
-def center_in_outline(center_x: int, center_y: int, raw_outline_data: str) -> bool:
+def get_frame_index(training_data: pd.DataFrame) -> dict:
     """
-    use shapely library to see if a point is in the raw outline data
+    get index from each frame of training data to the positions of its single cells
 
     Parameters
     ----------
-    center_x : int
-        x coord of cell center
-    center_y : int
-        y coord of cell center
-    raw_outline_data : str
-        raw outline data of cell
+    training_data : pd.DataFrame
+        all single cell features from all frames with any labeled cells
+
+    Returns
+    -------
+    dict
+        (plate, well, frame) string tuples as keys and
+        np.ndarray of row positions of single cells in training_data as values
+    """
+    frame_metadata = training_data[
+        ["Metadata_Plate", "Metadata_Well", "Metadata_Frame"]
+    ].astype(str)
+
+    return frame_metadata.groupby(list(frame_metadata.columns), sort=False).indices
+
+
+def match_frame_samples(frame_samples: list, outlines) -> list:
+    """
+    match labeled samples from a shard of frames to the single cells of those frames
+    outlines are decoded frame by frame, so invalid outlines only leave the samples
+    of their own frame unmatched
+
+    Parameters
+    ----------
+    frame_samples : list
+        (centers_x, centers_y, outline_positions) tuple for each frame in shard,
+        outline_positions are the positions in outlines of the single cells from that frame
+    outlines : pa.Array, pa.ChunkedArray, pd.Series, or list
+        compact arrow outlines or strings of outline data for all single cells in shard
 
     Returns
     -------
-    bool
-        whether or not coords are in outline
+    list
+        np.ndarray for each frame with position in outlines of cell matched to each sample,
+        -1 if no cell is matched
     """
-    outline_data = parse_outline_data(raw_outline_data)
-    point = Point(center_x, center_y)
-    cell_polygon = Polygon(outline_data)
-    return cell_polygon.contains(point)
+    if not isinstance(outlines, (pa.Array, pa.ChunkedArray)):
+        outlines = pd.Series(outlines, dtype=object)
+    frame_matches = []
+
+    for centers_x, centers_y, outline_positions in frame_samples:
+        if isinstance(outlines, pd.Series):
+            frame_outlines = outlines.iloc[outline_positions]
+        else:
+            frame_outlines = outlines.take(outline_positions)
+
+        try:
+            polygons = get_outline_polygons(frame_outlines)
+        except (ValueError, shapely.GEOSException) as error:
+            print(f"Could not decode outlines of frame, its samples are not matched: {error}")
+            frame_matches.append(np.full(len(centers_x), -1))
+            continue
+
+        matches = match_centers_to_polygons(centers_x, centers_y, polygons)
+        matches[matches != -1] = outline_positions[matches[matches != -1]]
+        frame_matches.append(matches)
+
+    return frame_matches
 
 
 def get_labeled_cells(
     training_data: pd.DataFrame,
     features_samples_path: pathlib.Path,
     outlines_column: str,
+    n_workers: int = 1,
 ) -> pd.DataFrame:
     """
     get labeled cells as dataframe from all training data and features samples
@@ -104,51 +183,89 @@ def get_labeled_cells(
         path to features samples file
     outlines_column : str
         name of column in training_data that has outline data
+    n_workers : int, optional
+        number of processes to match labeled samples with,
+        samples are sharded by frame across processes, by default 1
 
     Returns
     -------
     pd.DataFrame
-        dataframe with all labeled cells
+        dataframe with all labeled cells, in order of features samples file
     """
-    with open(features_samples_path) as labels_file:
-        labeled_cells = []
-
-        # iterate through each sample and see if it has features in the total training data dataframe
-        for line in labels_file:
-            # get phenotpic label of cell from feature samples file line
-            phenotypic_class = line.strip().split("\t")[0]
-            # get frame info from feature samples file line
-            frame_details = line.strip().split("\t")[1]
-            plate, well_num, frame, center_x, center_y = get_frame_metadata(
-                frame_details
+    samples = load_features_samples(features_samples_path)
+    frame_index = get_frame_index(training_data)
+    # position in training_data of cell matched to each sample, -1 if no cell is matched
+    sample_matches = np.full(len(samples), -1)
+
+    # get labeled samples and single cell positions for each frame with single cells
+    # only outlines of frames with labeled samples are decoded
+    frames = []
+    for (plate, well_num, frame), frame_samples in samples.groupby(
+        ["plate", "well_num", "frame"], sort=False
+    ):
+        frame_positions = frame_index.get((plate, str(well_num), str(frame)))
+        if frame_positions is not None:
+            frames.append((frame_samples, frame_positions))
+
+    # shard frames so each process only gets the outlines of its own frames
+    n_shards = min(len(frames), n_workers * 4 if n_workers > 1 else 1)
+    shards = [frames[shard_index::n_shards] for shard_index in range(n_shards)]
+    shards_positions = []
+    shard_args = []
+    for shard in shards:
+        shard_positions = np.concatenate([frame_positions for _, frame_positions in shard])
+        shards_positions.append(shard_positions)
+        shard_frame_samples = []
+        shard_start = 0
+        for frame_samples, frame_positions in shard:
+            shard_frame_samples.append(
+                (
+                    frame_samples["center_x"].to_numpy(),
+                    frame_samples["center_y"].to_numpy(),
+                    np.arange(shard_start, shard_start + len(frame_positions)),
+                )
             )
-            # get all single cell features for this particular frame
-            frame_cells = training_data.loc[
-                (training_data["Metadata_Plate"] == plate)
-                & (training_data["Metadata_Well"] == str(well_num))
-                & (training_data["Metadata_Frame"] == str(frame))
+            shard_start += len(frame_positions)
+        shard_args.append(
+            (shard_frame_samples, training_data[outlines_column].iloc[shard_positions])
+        )
+
+    # match all samples from a frame to the single cell features from that frame at once
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            shard_matches = list(executor.map(match_frame_samples, *zip(*shard_args)))
+    else:
+        shard_matches = [match_frame_samples(*args) for args in shard_args]
+
+    # reassemble matches in order of features samples file
+    for shard, shard_positions, frame_matches in zip(
+        shards, shards_positions, shard_matches
+    ):
+        for (frame_samples, _), matches in zip(shard, frame_matches):
+            sample_matches[frame_samples.index[matches != -1]] = shard_positions[
+                matches[matches != -1]
             ]
 
-            included = False
-            # see if the center coords correspond to any feature data from the frame cells
-            for _, row in frame_cells.iterrows():
-                raw_outline_data = row[outlines_column]
-                if center_in_outline(center_x, center_y, raw_outline_data):
-                    full_row = pd.concat([pd.Series([phenotypic_class]), row])
-                    labeled_cells.append(full_row)
-                    included = True
-                    break
-
-            # some cells not found in DP-extracted feature collection because the wells are not hosted by IDR or differences in segmentation
-            if not included:
-                print(
-                    f"No feature data derived for cell at: {plate}, {well_num}, {frame}, {center_x}, {center_y}"
-                )
+    # some cells not found in DP-extracted feature collection because the wells are not hosted by IDR or differences in segmentation
+    missing_cells = samples.loc[
+        sample_matches == -1, ["plate", "well_num", "frame", "center_x", "center_y"]
+    ]
+    for plate, well_num, frame, center_x, center_y in missing_cells.itertuples(
+        index=False
+    ):
+        print(
+            f"No feature data derived for cell at: {plate}, {well_num}, {frame}, {center_x}, {center_y}"
+        )
 
-    labeled_cells = pd.DataFrame(labeled_cells)
-    labeled_cells = labeled_cells.rename(
-        columns={labeled_cells.columns[0]: "Mitocheck_Phenotypic_Class"}
+    # get matched single cells with one take and add their phenotypic class
+    matched = sample_matches != -1
+    labeled_cells = training_data.take(sample_matches[matched]).reset_index(drop=True)
+    labeled_cells.insert(
+        0,
+        "Mitocheck_Phenotypic_Class",
+        samples.loc[matched, "phenotypic_class"].to_numpy(),
     )
+
     # rename DP column that isnt part of features
     # idr_stream's merge function prefixes all data from idrstream_dp with DP__
     # but for Mitocheck labeled data, we only want DP features to have DP__ prefix